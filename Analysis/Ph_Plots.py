@@ -3,15 +3,24 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import adds
 
-def plot_ph():
-    
-    df=adds.get_master()
+# Get the rows of master that are plotted. master is used instead of
+# get_master() if given
+def get_ph_data(master=None):
+    if master is None:
+        master = adds.get_master()
 
     # Remove solutions with no recorded Ph so they don't take up space in the legend
-    df=df[(df["Solution"]=="Adipic Acid - 1.24mM")|(df["Solution"]=="Adipic Acid - 0.712mM")|(df["Solution"]=="Adipic Acid - 0.388mM")|(df["Solution"]=="Succinic 0.388mM")]
+    df=master[(master["Solution"]=="Adipic Acid - 1.24mM")|(master["Solution"]=="Adipic Acid - 0.712mM")|(master["Solution"]=="Adipic Acid - 0.388mM")|(master["Solution"]=="Succinic 0.388mM")].copy()
+    if df["Solution"].dtype=="category":
+        df["Solution"]=df["Solution"].cat.remove_unused_categories()
+    return df
+
+# Plot the data from get_ph_data, returning the figure
+def plot_ph(df):
+    fig, ax = plt.subplots()
 
     # Plot
-    ax=sns.scatterplot(x="Ph", y="Time to Failure (ms)", data=df, hue="Solution")
+    sns.scatterplot(x="Ph", y="Time to Failure (ms)", data=df, hue="Solution", ax=ax)
     
     ax.set_title("Time to Failure (ms) vs. Ph by Solution Type")
 
@@ -19,7 +28,9 @@ def plot_ph():
     sns.move_legend(ax, "upper left", bbox_to_anchor=(1, 1))
 
     # Tight layout so the legend doesn't get cut off
-    plt.tight_layout()
+    fig.tight_layout()
+    return fig
+
+if __name__ == "__main__":
+    plot_ph(get_ph_data())
     plt.show()
-    
-plot_ph()
@@ -3,85 +3,472 @@
 # loss of useful data.
 
 import reads
+import instrument
+import parallel
+import dendrite_maps
 import pandas as pd
 import numpy as np
 import os
+import hashlib
 import typing
 import cv2
-import math
+import warnings
 
-# Get the cleaned master data
-def get_master(dendrite_score_col=False):
-    # Read in data
-    master = reads.get_master()
-    
+# Cache of the mean RGB values of sensor images, used by get_image_stats
+IMAGE_STATS_CACHE = "Imgscans_sensors_stats.csv"
+
+# Directories of the sensor images joined onto master
+SENSOR_IMAGE_DIRS = ["Imgscans_PRISTINE_sensors", "Imgscans_EXPOSED_sensors"]
+
+# Columns that identify a sensor across masterlists
+MASTER_KEYS = ["Board ID", "Sensor"]
+
+# Get the mean R, G, and B values of a sensor image, or None if it couldn't be
+# read. reduce is passed to reads.get_sensor_image, so the means can be taken
+# from a smaller decode. This is at the top level so that worker processes can
+# run it
+@instrument.stage("adds.get_channel_means")
+def get_channel_means(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"], reduce=1):
+    image = reads.get_sensor_image(file_name, age, reduce)
+    if image is None:
+        return None
+
+    # Mean of each channel in one pass over the BGR image, rather than making
+    # an RGB copy and a copy of each channel
+    b, g, r, _ = cv2.mean(image)
+    return r, g, b
+
+# Get a DataFrame of every sensor image file name of an age, with the board ID,
+# pattern, and sensor parsed out of the name. Names that don't follow the
+# Batch_Pattern_ID_Iteration_Sensor convention are reported and left out
+@instrument.stage("adds.get_sensor_image_names")
+def get_sensor_image_names(age: typing.Literal["EXPOSED", "PRISTINE"]):
+    file_names = pd.Series(sorted(os.listdir(f"Imgscans_{age}_sensors")), dtype=object)
+
+    # Split all names at once into their 5 components
+    components = file_names.str.extract(r"^([^_.]+)_([^_.]+)_([^_.]+)_([^_.]+)_([^_.]+)(?:\.|$)")
+
+    # Report and drop unconventional names
+    invalid = components[0].isna()
+    if invalid.any():
+        warnings.warn(f"Skipped unconventional {age} sensor image names: {file_names[invalid].tolist()}")
+
+    names = pd.DataFrame({
+        "Board ID": components[0] + "_" + components[1] + "_" + components[2],
+        "Pattern": pd.to_numeric(components[1], errors="coerce"),
+        "Sensor": components[4],
+        "File Name": file_names
+    })
+    return names[~invalid]
+
+# Left join image file names onto master with a single merge, storing them in
+# col. Keys that match more than one image are reported and left empty, rather
+# than picking one of the images
+@instrument.stage("adds.join_sensor_image_names")
+def join_sensor_image_names(master: pd.DataFrame, names: pd.DataFrame, keys: list, col: str):
+    names = names[keys + ["File Name"]].rename(columns={"File Name": col})
+
+    # Report and drop ambiguous keys
+    duplicated = names.duplicated(subset=keys, keep=False)
+    if duplicated.any():
+        warnings.warn(f"Multiple images match the same sensor, so {col} is left empty for: {names.loc[duplicated, col].tolist()}")
+        names = names[~duplicated]
+
+    # Match master's key types, so categorical keys stay categorical. Names
+    # whose keys aren't in master's categories can't match, so are dropped
+    names = names.astype({key: master[key].dtype for key in keys}).dropna(subset=keys)
+
+    # The index is kept, because a merge would otherwise replace it
+    return master.merge(names, on=keys, how="left", validate="many_to_one").set_index(master.index)
+
+# Read the image statistics cache as a DataFrame
+def read_image_stats_cache():
+    if not os.path.isfile(IMAGE_STATS_CACHE):
+        return pd.DataFrame(columns=["Path", "Reduce", "Size", "Mtime", "Hash", "R", "G", "B"])
+    # Round trip precision, so cached means are identical to computed ones
+    cache = pd.read_csv(IMAGE_STATS_CACHE, float_precision="round_trip")
+    # Caches from before reduced decoding only have full size means
+    if "Reduce" not in cache.columns:
+        cache.insert(1, "Reduce", 1)
+    return cache
+
+# Get the mean R, G, and B values of sensor images, given a list of (file name,
+# age). Values are cached by the image's contents and reduce, so an image is
+# only read again after it changes. Uncached images are computed together, with
+# workers and chunk_size passed to parallel.run_tasks, and reduce passed to
+# get_channel_means. Returns a DataFrame with File Name, Age, R, G, and B
+# columns, for the images that could be read
+@instrument.stage("adds.get_image_stats")
+def get_image_stats(images: list, workers=1, chunk_size=8, reduce=1):
+    cache = read_image_stats_cache()
+    path_to_entry = {(entry["Path"], entry["Reduce"]): entry for entry in cache.to_dict("records")}
+    hash_to_entry = {(entry["Hash"], entry["Reduce"]): entry for entry in path_to_entry.values()}
+
+    rows = [] # Rows of the result
+    uncached = [] # Images that need their means computed
+    new_entries = [] # Cache entries that are new or changed
+
+    for file_name, age in images:
+        path = f"Imgscans_{age}_sensors/{file_name}"
+        if not os.path.isfile(path):
+            continue
+
+        # An unchanged size and modified time means an unchanged image
+        stat = os.stat(path)
+        entry = path_to_entry.get((path, reduce))
+        if entry is not None and entry["Size"] == stat.st_size and entry["Mtime"] == stat.st_mtime_ns:
+            rows.append((file_name, age, entry["R"], entry["G"], entry["B"]))
+            continue
+
+        # Otherwise look the image up by its contents
+        content_hash = reads.file_hash(path)
+        entry = hash_to_entry.get((content_hash, reduce))
+        if entry is not None:
+            rows.append((file_name, age, entry["R"], entry["G"], entry["B"]))
+            new_entries.append({**entry, "Path": path, "Size": stat.st_size, "Mtime": stat.st_mtime_ns})
+            continue
+
+        uncached.append((file_name, age, path, stat, content_hash))
+
+    # Compute all uncached images in one batch
+    tasks = [(file_name, age, reduce) for file_name, age, _, _, _ in uncached]
+    for (file_name, age, path, stat, content_hash), means in zip(uncached, parallel.run_tasks(get_channel_means, tasks, workers, chunk_size)):
+        # Skip images that couldn't be read
+        if means is None:
+            continue
+        r, g, b = means
+        rows.append((file_name, age, r, g, b))
+        new_entries.append({"Path": path, "Reduce": reduce, "Size": stat.st_size, "Mtime": stat.st_mtime_ns, "Hash": content_hash, "R": r, "G": g, "B": b})
+
+    # Save new entries, replacing old entries for the same path
+    if len(new_entries) > 0:
+        for entry in new_entries:
+            path_to_entry[(entry["Path"], entry["Reduce"])] = entry
+        pd.DataFrame(list(path_to_entry.values()), columns=cache.columns).to_csv(IMAGE_STATS_CACHE, index=False)
+
+    # Means stay numbers when no image could be read
+    return pd.DataFrame(rows, columns=["File Name", "Age", "R", "G", "B"]).astype({"R": float, "G": float, "B": float})
+
+# Get the file name of each sensor's measurement files, as a DataFrame indexed
+# by Board ID and Sensor, with a column for each master file name column. When a
+# sensor has several files of a kind, such as exposed measurements from more
+# than one date, the latest date and iteration is used. Every file, including
+# the ones not used here, is in reads.get_file_index(). With board_ids, only
+# those boards' files are looked up
+@instrument.stage("adds.get_sensor_file_names")
+def get_sensor_file_names(board_ids=None):
+    index = reads.get_file_index()
+    if board_ids is not None:
+        index = index[index["Board ID"].isin(board_ids)]
+    index = index.sort_values(["Date", "Iteration"])
+
+    # Master column -> (type, age) of the files it names
+    col_to_files = {
+        "CV_Baseline": ("CV", "PRISTINE"),
+        "CV_Post": ("CV", "EXPOSED"),
+        "CF_Baseline": ("CF", "PRISTINE"),
+        "CF_Post": ("CF", "EXPOSED"),
+        "Current": ("Current", None)
+    }
+    sensor_file_names = {}
+    for col, (type, age) in col_to_files.items():
+        files = index[(index["Type"] == type) & ((index["Age"] == age) if age is not None else True)]
+        sensor_file_names[col] = files.groupby(["Board ID", "Sensor"])["File Name"].last()
+
+    return pd.DataFrame(sensor_file_names)
+
+# Fill in master's CV, CF, and CurrentTime file name columns from the file
+# index. Names typed into the masterlist are kept if the file exists, and
+# Current values that aren't file names are kept as they are
+@instrument.stage("adds.fill_file_names")
+def fill_file_names(master: pd.DataFrame):
+    sensor_file_names = get_sensor_file_names(master["Board ID"].dropna().astype(object).unique())
+
+    # Each master row's files, found by its board ID and sensor
+    keys = pd.MultiIndex.from_frame(master[["Board ID", "Sensor"]].astype(object))
+    found = sensor_file_names.reindex(keys).set_axis(master.index)
+
+    indexed_files = reads.get_file_index()["File Name"]
+    for col in sensor_file_names.columns:
+        dtype = master[col].dtype
+        # Both as objects, so filling one from the other never changes types
+        names = master[col].astype(object)
+        found_names = found[col].astype(object)
+        # Only replace missing names, and names of files that don't exist, with
+        # a file that was found
+        replace = (names.isna() | (names.astype(str).str.endswith(".csv") & ~names.isin(indexed_files))) & found_names.notna()
+        master[col] = names.mask(replace, found_names).astype("category" if dtype == "category" else object)
+
+    return master
+
+# Add mean RGB columns of each sensor's pristine and exposed images, and a
+# "Dendrite Score" column of the distance between them, returning a new
+# DataFrame. workers, chunk_size, and reduce are passed to get_image_stats
+@instrument.stage("adds.add_dendrite_score")
+def add_dendrite_score(master: pd.DataFrame, workers=1, chunk_size=8, reduce=1):
+    # Each pristine image is shared by many rows, so get each unique image
+    # only once
+    images = list(dict.fromkeys(
+        (file_name, age)
+        for age in ["PRISTINE", "EXPOSED"]
+        for file_name in master[f"Image_{age}"]
+        if isinstance(file_name, str)
+    ))
+    # Get mean RGB of every image, from the cache where possible
+    stats = get_image_stats(images, workers, chunk_size, reduce)
+
+    # Join each age's mean RGB values onto its image column
+    for age in ["PRISTINE", "EXPOSED"]:
+        age_stats = stats[stats["Age"] == age].drop(columns="Age").rename(columns={
+            "File Name": f"Image_{age}", "R": f"R_{age}", "G": f"G_{age}", "B": f"B_{age}"
+        })
+        master = master.merge(age_stats, on=f"Image_{age}", how="left").set_index(master.index)
+
+    # Only keep rows where both images could be read
+    rgb_cols = ["R_PRISTINE", "G_PRISTINE", "B_PRISTINE", "R_EXPOSED", "G_EXPOSED", "B_EXPOSED"]
+    missing = master["R_PRISTINE"].isna() | master["R_EXPOSED"].isna()
+    master.loc[missing, rgb_cols] = np.nan
+
+    # Generate and store score
+    master["Dendrite Score"] = np.sqrt(
+        (master["R_EXPOSED"] - master["R_PRISTINE"])**2 +
+        (master["G_EXPOSED"] - master["G_PRISTINE"])**2 +
+        (master["B_EXPOSED"] - master["B_PRISTINE"])**2
+    )
+
+    return master
+
+# Add image and measurement file names to masterlist rows from reads.get_master,
+# and the columns asked for, returning a new DataFrame. Each row is joined on
+# its own, so any subset of rows can be joined. The arguments are those of
+# get_master
+@instrument.stage("adds.join_master")
+def join_master(master: pd.DataFrame, dendrite_score_col=False, workers=1, chunk_size=8, reduce=1, dendrite_map_cols=False):
     # Add image file names
-    for file_name in os.listdir("Imgscans_PRISTINE_sensors"):
-        # Get components
-        batch, pattern, id, _, sensor = file_name.split(".")[0].split("_")
-        pattern = int(pattern)
-        # Mask only where pattern and sensor match
-        mask = (master["Pattern"] == pattern) & (master["Sensor"] == sensor)
-        # Store the file name using the mask
-        master.loc[mask, "Image_PRISTINE"] = file_name
-    for file_name in os.listdir("Imgscans_EXPOSED_sensors"):
-        # Get components
-        batch, pattern, id, _, sensor = file_name.split(".")[0].split("_")
-        board_id = "_".join([batch, pattern, id])
-        # Mask only where board ID and sensor match
-        mask = (master["Board ID"] == board_id) & (master["Sensor"] == sensor)
-        # Store the file name using the mask
-        master.loc[mask, "Image_EXPOSED"] = file_name
-    # TODO Remove CV, CF, and CurrentTime file names from the stored CSV. Add
-    # code here to populate those columns automatically
+    # Pristine boards are the same for every board of a pattern, so they are
+    # joined on pattern and sensor
+    pristine = get_sensor_image_names("PRISTINE")
+    master = join_sensor_image_names(master, pristine, ["Pattern", "Sensor"], "Image_PRISTINE")
+    # Exposed images are joined on their own board and sensor
+    exposed = get_sensor_image_names("EXPOSED")
+    master = join_sensor_image_names(master, exposed, ["Board ID", "Sensor"], "Image_EXPOSED")
+    # Fill in CV, CF, and CurrentTime file names from the file index
+    master = fill_file_names(master)
 
     if dendrite_score_col:
-        # Get dendrite score of the exposed file, compared to the pristine
-        def gen_dendrite_score(master_index, master_row):
-            # Read images
-            pristine_image = reads.get_sensor_image(master_row["Image_PRISTINE"], "PRISTINE")
-            exposed_image = reads.get_sensor_image(master_row["Image_EXPOSED"], "EXPOSED")
-
-            # Return NaN if images couldn't be read
-            if pristine_image is None or exposed_image is None:
-                # NaN is used instead of None because NaN is for numbers, None
-                # is for objects
-                return np.nan
-
-            # Reorder from BGR to RGB
-            pristine_image = cv2.cvtColor(pristine_image, cv2.COLOR_BGR2RGB)
-            exposed_image = cv2.cvtColor(exposed_image, cv2.COLOR_BGR2RGB)
-
-            # Split into RGB components
-            r1, g1, b1 = cv2.split(pristine_image)
-            r2, g2, b2 = cv2.split(exposed_image)
-
-            # Convert rgb arrays into mean values
-            r1, g1, b1 = np.mean(r1), np.mean(g1), np.mean(b1)
-            r2, g2, b2 = np.mean(r2), np.mean(g2), np.mean(b2)
-
-            # Generate and store score
-            master.loc[master_index, "Dendrite Score"] = math.sqrt((r2 - r1)**2 + (g2 - g1)**2 + (b2 - b1)**2)
-
-            # Store RGB values
-            master.loc[master_index, "R_PRISTINE"] = r1
-            master.loc[master_index, "G_PRISTINE"] = g1
-            master.loc[master_index, "B_PRISTINE"] = b1
-            master.loc[master_index, "R_EXPOSED"] = r2
-            master.loc[master_index, "G_EXPOSED"] = g2
-            master.loc[master_index, "B_EXPOSED"] = b2
-
-        # Populate mean RGB and dendrite score
-        for i, row in master.iterrows():
-            gen_dendrite_score(i, row)
+        master = add_dendrite_score(master, workers, chunk_size, reduce)
+    if dendrite_map_cols:
+        master = dendrite_maps.add_dendrite_map_cols(master, workers=workers, chunk_size=chunk_size, reduce=reduce)
 
     return master
 
+# Get the cleaned master data, from the masterlist exported on date, (as
+# YYYYMMDD), or the latest one if date is None. With dendrite_map_cols, the
+# summary columns of each sensor's dendrite map are added, (see
+# dendrite_maps.py). workers, chunk_size, and reduce are passed to
+# add_dendrite_score and dendrite_maps.add_dendrite_map_cols
+@instrument.stage("adds.get_master")
+def get_master(dendrite_score_col=False, workers=1, chunk_size=8, reduce=1, dendrite_map_cols=False, date=None):
+    # Read in data
+    master = reads.get_master(date)
+    return join_master(master, dendrite_score_col, workers, chunk_size, reduce, dendrite_map_cols)
+
+# Get a MultiIndex of each master row's key for comparing masterlists, its
+# MASTER_KEYS and an "Occurrence" of which time they're listed, so sensors listed
+# more than once are compared in order
+def get_master_keys(master: pd.DataFrame):
+    # Categories differ between masterlists, so keys are compared as objects
+    keys = master[MASTER_KEYS].astype(object)
+    keys["Occurrence"] = keys.groupby(MASTER_KEYS, dropna=False).cumcount()
+    return pd.MultiIndex.from_frame(keys)
+
+# Compare an old and new masterlist row by row, as from reads.get_master.
+# Returns a DataFrame with a row per sensor that was added, changed, or removed,
+# in the order of new then old, with columns:
+#   - MASTER_KEYS and "Occurrence", from get_master_keys
+#   - "Change": "New", "Changed", or "Removed"
+#   - "Old Index" and "New Index": the row's index in each masterlist, NaN
+#     where it isn't in one
+#   - "Changed Columns": the columns whose values differ, separated by ", "
+# Sensors that are the same in both are left out
+@instrument.stage("adds.diff_masterlists")
+def diff_masterlists(old: pd.DataFrame, new: pd.DataFrame):
+    old_keys, new_keys = get_master_keys(old), get_master_keys(new)
+    old_positions = pd.Series(np.arange(len(old)), index=old_keys)
+    in_old = new_keys.isin(old_keys)
+    in_new = old_keys.isin(new_keys)
+
+    # Sensors in both whose rows hash the same are unchanged, so only the rest
+    # are compared a column at a time. Hashes are of values, not categorical
+    # codes, so they match across masterlists
+    matched_new = np.flatnonzero(in_old)
+    matched_old = old_positions.reindex(new_keys[in_old]).to_numpy()
+    cols = list(dict.fromkeys([*new.columns, *old.columns]))
+    if list(old.columns) == list(new.columns):
+        old_hashes = pd.util.hash_pandas_object(old.iloc[matched_old], index=False).to_numpy()
+        new_hashes = pd.util.hash_pandas_object(new.iloc[matched_new], index=False).to_numpy()
+        matched_new, matched_old = matched_new[old_hashes != new_hashes], matched_old[old_hashes != new_hashes]
+
+    # A column only in one masterlist counts as changed
+    differs = np.ones((len(matched_new), len(cols)), dtype=bool)
+    for i, col in enumerate(cols):
+        if col in old.columns and col in new.columns:
+            old_values = old[col].iloc[matched_old].astype(object).reset_index(drop=True)
+            new_values = new[col].iloc[matched_new].astype(object).reset_index(drop=True)
+            differs[:, i] = ~((old_values == new_values) | (old_values.isna() & new_values.isna())).to_numpy()
+    changed = differs.any(axis=1)
+    changed_cols = [", ".join(np.array(cols)[row]) for row in differs[changed]]
+
+    # Sensors in the order of new, then removed sensors in the order of old
+    added = np.flatnonzero(~in_old)
+    removed = np.flatnonzero(~in_new)
+    changes = pd.concat([
+        pd.DataFrame({"Change": "New", "Old Index": np.nan, "New Index": new.index[added], "Changed Columns": "", "Order": added}, index=new_keys[added]),
+        pd.DataFrame({"Change": "Changed", "Old Index": old.index[matched_old[changed]], "New Index": new.index[matched_new[changed]], "Changed Columns": changed_cols, "Order": matched_new[changed]}, index=new_keys[matched_new[changed]]),
+        pd.DataFrame({"Change": "Removed", "Old Index": old.index[removed], "New Index": np.nan, "Changed Columns": "", "Order": len(new) + removed}, index=old_keys[removed])
+    ])
+
+    return changes.sort_values("Order", kind="stable").drop(columns="Order").reset_index()
+
+# Get the changes between the masterlists exported on old_date and new_date, (as
+# YYYYMMDD), as from diff_masterlists. By default, the latest masterlist is
+# compared with the one before it
+def get_masterlist_changes(old_date=None, new_date=None):
+    dates = list(reads.get_masterlist_paths())
+    if new_date is None:
+        new_date = dates[-1]
+    if old_date is None:
+        earlier = [date for date in dates if date < new_date]
+        if len(earlier) == 0:
+            raise FileNotFoundError(f"No masterlist from before {new_date} to compare with")
+        old_date = earlier[-1]
+    return diff_masterlists(reads.get_master(old_date), reads.get_master(new_date))
+
+# Get the paths where get_master_incremental keeps what it last ingested, which
+# are separate for each set of columns asked for. These are csvs of the
+# masterlist and of the joined master, of each of their columns' data types,
+# and of the fingerprint of the joins' sources they were made with
+def get_ingest_paths(dendrite_score_col=False, reduce=1, dendrite_map_cols=False):
+    prefix = f"{reads.STORE_DIR}/master_ingest_{int(dendrite_score_col)}{int(dendrite_map_cols)}_{reduce}"
+    return {part: f"{prefix}_{part.lower()}.csv" for part in ["Masterlist", "Master", "Dtypes", "Fingerprint"]}
+
+# Get a value that changes when the sources of master's joins change: any
+# sensor image, or which measurement files there are. Measurement files are
+# only joined by name, so only their directories are checked. compact_dtypes
+# is included, since it changes how every row is read back
+def get_join_fingerprint():
+    fingerprint = (
+        tuple(reads.get_fingerprint(path) for path in SENSOR_IMAGE_DIRS),
+        tuple(sorted(reads.get_file_index_mtimes().items())),
+        reads.compact_dtypes
+    )
+    return hashlib.sha1(repr(fingerprint).encode()).hexdigest()
+
+# Write what get_master_incremental ingested to the paths from get_ingest_paths.
+# Dates are written in the masterlist's format, so MASTER_SCHEMA parses them
+# the same way when they're read back
+def write_ingested(paths: dict, fingerprint: str, master: pd.DataFrame, joined: pd.DataFrame):
+    os.makedirs(reads.STORE_DIR, exist_ok=True)
+    date_format = reads.MASTER_SCHEMA["Date"]
+    master.to_csv(paths["Masterlist"], index_label="Master Index", date_format=date_format)
+    joined.to_csv(paths["Master"], index_label="Master Index", date_format=date_format)
+    pd.concat([
+        pd.DataFrame({"Part": part, "Column": df.columns, "Dtype": df.dtypes.astype(str).to_numpy()})
+        for part, df in [("Masterlist", master), ("Master", joined)]
+    ]).to_csv(paths["Dtypes"], index=False)
+    pd.DataFrame({"Fingerprint": [fingerprint]}).to_csv(paths["Fingerprint"], index=False)
+
+# Read what get_master_incremental last ingested, as a dict of Fingerprint,
+# Masterlist, and Master, or None if any of it is missing. MASTER_SCHEMA is
+# applied again, then columns whose data type still differs from the one they
+# were written with are cast to it. Text is read back as whatever pandas
+# infers, which isn't always the object type the joins make
+def read_ingested(paths: dict):
+    if not all(os.path.isfile(path) for path in paths.values()):
+        return None
+
+    ingested = {"Fingerprint": pd.read_csv(paths["Fingerprint"])["Fingerprint"].iloc[0]}
+    dtypes = pd.read_csv(paths["Dtypes"], dtype=object)
+    for part in ["Masterlist", "Master"]:
+        df = pd.read_csv(paths[part], index_col="Master Index", float_precision="round_trip")
+        df = reads.apply_schema(df.rename_axis(None), reads.MASTER_SCHEMA)
+        part_dtypes = dtypes[dtypes["Part"] == part].set_index("Column")["Dtype"]
+        ingested[part] = df.astype({col: dtype for col, dtype in part_dtypes.items() if str(df[col].dtype) != dtype})
+    return ingested
+
+# Get the same DataFrame as get_master, in time proportional to how much the
+# masterlist changed since the last call. The masterlist is compared with the
+# one last ingested, (see diff_masterlists), and only new and changed rows are
+# joined, while unchanged rows are reused from the last result. Everything is
+# joined again if the sources of the joins changed, (see get_join_fingerprint),
+# since those can affect any row. The arguments are those of get_master
+@instrument.stage("adds.get_master_incremental")
+def get_master_incremental(dendrite_score_col=False, workers=1, chunk_size=8, reduce=1, dendrite_map_cols=False, date=None):
+    master = reads.get_master(date)
+    ingest_paths = get_ingest_paths(dendrite_score_col, reduce, dendrite_map_cols)
+    fingerprint = get_join_fingerprint()
+    ingested = read_ingested(ingest_paths)
+
+    if ingested is None or ingested["Fingerprint"] != fingerprint:
+        joined = join_master(master, dendrite_score_col, workers, chunk_size, reduce, dendrite_map_cols)
+    else:
+        changes = diff_masterlists(ingested["Masterlist"], master)
+        rejoin = changes.loc[changes["Change"] != "Removed", "New Index"].astype(master.index.dtype).to_numpy()
+
+        # Unchanged rows are reused, under their index in the new masterlist
+        old_keys, new_keys = get_master_keys(ingested["Masterlist"]), get_master_keys(master)
+        reuse = ~master.index.isin(rejoin)
+        old_positions = pd.Series(np.arange(len(old_keys)), index=old_keys).reindex(new_keys[reuse]).to_numpy()
+        joined = ingested["Master"].iloc[old_positions].set_axis(master.index[reuse])
+
+        if len(rejoin) > 0:
+            rejoined = join_master(master.loc[rejoin], dendrite_score_col, workers, chunk_size, reduce, dendrite_map_cols)
+            # Columns that are all missing in the joined rows take the reused
+            # rows' types, rather than changing the result's types
+            all_missing = [col for col in rejoined.columns if rejoined[col].isna().all() and col in joined.columns]
+            rejoined = rejoined.astype({col: joined[col].dtype for col in all_missing})
+
+            # Categoricals get the sorted categories of both, like a full join,
+            # so they stay categorical when put together
+            for col in joined.columns:
+                if joined[col].dtype == "category" and rejoined[col].dtype == "category":
+                    categories = sorted(set(joined[col].cat.categories) | set(rejoined[col].cat.categories))
+                    joined[col] = joined[col].cat.set_categories(categories)
+                    rejoined[col] = rejoined[col].cat.set_categories(categories)
+            joined = pd.concat([joined, rejoined])
+
+        # Back in the new masterlist's order, without categories of removed rows
+        joined = joined.reindex(master.index)
+        for col in joined.columns:
+            if joined[col].dtype == "category":
+                joined[col] = joined[col].cat.remove_unused_categories()
+
+    write_ingested(ingest_paths, fingerprint, master, joined)
+
+    return joined
+
+# Check that get_master_incremental gives the same DataFrame as get_master, both
+# when it joins every row and when it reuses every row of the last ingest. What
+# was last ingested with the same arguments is deleted first. The arguments are
+# those of get_master. Raises an AssertionError if they differ
+def check_master_incremental(dendrite_score_col=False, reduce=1, dendrite_map_cols=False):
+    for path in get_ingest_paths(dendrite_score_col, reduce, dendrite_map_cols).values():
+        if os.path.isfile(path):
+            os.remove(path)
+
+    expected = get_master(dendrite_score_col, reduce=reduce, dendrite_map_cols=dendrite_map_cols)
+    # The first call joins every row, and the second reuses them
+    for _ in range(2):
+        pd.testing.assert_frame_equal(get_master_incremental(dendrite_score_col, reduce=reduce, dendrite_map_cols=dendrite_map_cols), expected)
+
 # Get a DataFrame that is the merging of the master data and all the
 # CurrentTime files. Each row represents one current measurement at a given
-# time, and it has data about the sensor, solution, etc.
-def get_master_current_time():
-    master = get_master()
+# time, and it has data about the sensor, solution, etc. master is used instead
+# of get_master() if given
+@instrument.stage("adds.get_master_current_time")
+def get_master_current_time(master=None):
+    if master is None:
+        master = get_master()
 
     current_time_all = [] # List of all currentTime data frames
 
@@ -91,7 +478,7 @@ def get_master_current_time():
         current_in = row["Current"]
 
         # Read file, and skip if result is None
-        current_time = reads.get_current_time(current_in)
+        current_time = reads.get_current_time(current_in, schema=False)
         if current_time is None:
             continue
 
@@ -102,7 +489,7 @@ def get_master_current_time():
         current_time_all.append(current_time)
 
     # Convert current_time_all, (a list), to a concatenation of all its contents
-    current_time_all = pd.concat(current_time_all)
+    current_time_all = reads.apply_schema(pd.concat(current_time_all), reads.MEASUREMENT_SCHEMA)
 
     # Join master with current_time_all
     master_current_time = master.merge(
@@ -116,57 +503,149 @@ def get_master_current_time():
 
     return master_current_time
 
+# Yield the master merged with the CurrentTime files one piece at a time, so that
+# only one piece is in memory at once. Each piece is a (key, DataFrame) tuple.
+# With group_by as None, each piece is one sensor's file, keyed by its master
+# index. Otherwise each piece is every sensor sharing the same values of the
+# group_by columns, such as "Voltage", keyed by those values. master_cols limits
+# which master columns are copied onto each measurement. master is used instead
+# of get_master() if given. With buckets, the files are read at that level of
+# detail for plotting, (see reads.get_current_time_lod)
+def iter_master_current_time(group_by=None, master_cols=None, master=None, buckets=None):
+    if master is None:
+        master = get_master()
+    if master_cols is not None:
+        # The group_by columns are kept too, since they're needed for grouping
+        group_cols = [group_by] if isinstance(group_by, str) else list(group_by or [])
+        master = master[list(dict.fromkeys([*master_cols, *group_cols, "Current"]))]
+
+    # Merge one master row with its CurrentTime file, returning None if there
+    # is no file
+    def get_sensor_current_time(index):
+        current_time = reads.get_current_time_lod(master.at[index, "Current"], buckets)
+        if current_time is None:
+            return None
+        return master.loc[[index]].drop(columns="Current").merge(current_time, how="cross")
+
+    # One piece per sensor
+    if group_by is None:
+        for index in master.index:
+            sensor_current_time = get_sensor_current_time(index)
+            if sensor_current_time is not None:
+                yield index, sensor_current_time
+        return
+
+    # One piece per group
+    for key, group in master.groupby(group_by, observed=True):
+        pieces = [get_sensor_current_time(index) for index in group.index]
+        pieces = [piece for piece in pieces if piece is not None]
+        if len(pieces) > 0:
+            yield key, pd.concat(pieces, ignore_index=True)
+
+# Get the CurrentTime measurements in a narrow form, along with the master data
+# they belong to. Instead of copying every master column onto every
+# measurement, each measurement has a categorical "Master Index" column that
+# refers to its row in master, such as master.loc[measurements["Master Index"]].
+# Returns a tuple of (master, measurements). master is used instead of
+# get_master() if given
+@instrument.stage("adds.get_current_time_narrow")
+def get_current_time_narrow(master=None):
+    if master is None:
+        master = get_master()
+
+    measurements = [] # List of all CurrentTime DataFrames
+    for index, current_in in master["Current"].items():
+        # Read file, and skip if result is None
+        current_time = reads.get_current_time(current_in, schema=False)
+        if current_time is None:
+            continue
+
+        # Refer to the master row this file belongs to
+        current_time["Master Index"] = index
+        measurements.append(current_time)
+
+    measurements = reads.apply_schema(pd.concat(measurements, ignore_index=True), reads.MEASUREMENT_SCHEMA)
+    # Categorical, so each measurement only stores a small code
+    measurements["Master Index"] = pd.Categorical(measurements["Master Index"], categories=master.index)
+
+    return master, measurements
+
 # Returns the master merged with all CF files, or all CV files. An "Age" column
-# is added to differentiate "PRISTINE" vs "EXPOSED"
-def get_master_cf_or_cv(cf_or_cv: typing.Literal["CF", "CV"]):
-    master = get_master()
+# is added to differentiate "PRISTINE" vs "EXPOSED". master_cols limits which
+# master columns are copied onto each measurement. filters is a dict of master
+# column -> value or list of values, such as {"Pattern": [1, 4], "Voltage": 5},
+# and only files of matching master rows are read. master is used instead of
+# get_master() if given
+@instrument.stage("adds.get_master_cf_or_cv")
+def get_master_cf_or_cv(cf_or_cv: typing.Literal["CF", "CV"], master_cols=None, filters=None, master=None):
+    if master is None:
+        master = get_master()
+
+    # Filter master before any file is read
+    if filters is not None:
+        for col, values in filters.items():
+            if not pd.api.types.is_list_like(values):
+                values = [values]
+            master = master[master[col].isin(values)]
 
     df_all = [] # List of all DataFrames, either cf or cv, has an Age column
 
     # Populate df_all with both ages
     for age in ["PRISTINE", "EXPOSED"]:
-        # For each row, read file, and append to list
-        for _, row in master.iterrows():
-            # Get file name
-            baseline_or_post = "Baseline" if age == "PRISTINE" else "Post"
-            file_name = row[f"{cf_or_cv}_{baseline_or_post}"]
-            
+        baseline_or_post = "Baseline" if age == "PRISTINE" else "Post"
+        file_names = master[f"{cf_or_cv}_{baseline_or_post}"].astype(object)
+
+        # Many master rows can share a file, so each file is read only once
+        file_to_df = {}
+        for file_name in file_names.dropna().unique():
             # Read df, skipping if result is None
-            df = reads.get_cf_or_cv(file_name)
-            if df is None:
-                continue
-            
-            # Add Age column to differentiate PRISTINE and EXPOSED
-            df["Age"] = age
-
-            # Add File Name column for joining purposes
-            df["File Name"] = file_name
-
-            # Append this DataFrame to list
-            df_all.append(df)
-
-    # Convert lists to a concatenation of all their contents
-    df_all = pd.concat(df_all, ignore_index=True)
-    
-    # Join master with baseline files
-    master_pristine = master.merge(
-        df_all,
-        left_on=f"{cf_or_cv}_Baseline",
-        right_on="File Name",
-        how="inner"
-    )
-    # Join master with post files
-    master_exposed = master.merge(
-        df_all,
-        left_on=f"{cf_or_cv}_Post",
-        right_on="File Name",
-        how="inner"
-    )
+            df = reads.get_cf_or_cv(file_name, schema=False)
+            if df is not None:
+                file_to_df[file_name] = df
+        if len(file_to_df) == 0:
+            continue
+        files = pd.concat(file_to_df.values(), ignore_index=True)
+        lengths = pd.Series([len(df) for df in file_to_df.values()], index=list(file_to_df))
+        starts = lengths.cumsum() - lengths
+
+        # Positions in files of each master row's rows, in master's order
+        row_files = file_names[file_names.isin(list(file_to_df))]
+        row_lengths = lengths.loc[row_files].to_numpy()
+        row_starts = starts.loc[row_files].to_numpy()
+        positions = np.arange(row_lengths.sum()) + np.repeat(row_starts - (np.cumsum(row_lengths) - row_lengths), row_lengths)
+        df = files.iloc[positions].reset_index(drop=True)
 
-    # Concat both merges into the result
-    master_cf_or_cv = pd.concat([master_pristine, master_exposed])
+        # Add Age column to differentiate PRISTINE and EXPOSED
+        df["Age"] = age
+
+        # Add the index of the master row each file belongs to, for joining
+        # purposes
+        df["Master Index"] = np.repeat(row_files.index.to_numpy(), row_lengths)
+
+        # Append this DataFrame to list
+        df_all.append(df)
+
+    # With no files to read, the result is empty but has the same columns
+    if len(df_all) == 0:
+        empty = pd.DataFrame({col: pd.Series(dtype="float64") for col in reads.MEASUREMENT_COLUMNS[cf_or_cv]})
+        df_all.append(empty.assign(**{
+            "Age": pd.Series(dtype=object), "Master Index": pd.Series(dtype=master.index.dtype)
+        }))
+
+    # Convert lists to a concatenation of all their contents, with the schema
+    # applied once rather than to each file
+    df_all = reads.apply_schema(pd.concat(df_all, ignore_index=True), reads.MEASUREMENT_SCHEMA)
+    if reads.compact_dtypes:
+        df_all["Age"] = df_all["Age"].astype("category")
 
     # The file names are no longer needed
-    master_cf_or_cv.drop(columns=["File Name", f"{cf_or_cv}_Baseline", f"{cf_or_cv}_Post"], inplace=True)
+    if master_cols is None:
+        master_cols = [col for col in master.columns if col not in [f"{cf_or_cv}_Baseline", f"{cf_or_cv}_Post"]]
+
+    # Join by looking up each file's master row, rather than merging on names
+    master_cf_or_cv = pd.concat([
+        master.loc[df_all["Master Index"], master_cols].reset_index(drop=True),
+        df_all.drop(columns="Master Index")
+    ], axis=1)
 
     return master_cf_or_cv
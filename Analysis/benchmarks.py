@@ -0,0 +1,403 @@
+# Timing of the slow parts of the pipeline, used to check that a change made
+# things faster. Run this file directly from the repository root.
+
+import adds
+import dendrite_maps
+import generators
+import parallel
+import reads
+import cv2
+import numpy as np
+import pandas as pd
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import typing
+
+# Where bench_pipeline stores its results
+BENCH_RESULTS_DIR = "BenchmarkResults"
+
+# Directories of the dataset that are copied into a synthetic dataset
+DATASET_DIRS = [
+    *reads.FILE_INDEX_DIRS,
+    "Imgscans_PRISTINE_edited", "Imgscans_EXPOSED_edited",
+    "Imgscans_PRISTINE_sensors", "Imgscans_EXPOSED_sensors"
+]
+# Directories of pristine images, which are the same for every board of a
+# pattern, so a synthetic dataset only has one copy of them
+PRISTINE_DIRS = ["Imgscans_PRISTINE_edited", "Imgscans_PRISTINE_sensors"]
+# Masterlist columns that hold board IDs or file names
+BOARD_COLS = ["Board ID", "Current", "CV_Post", "CF_Post", "CV_Baseline", "CF_Baseline"]
+
+# Time how long it takes to run func on every task with each worker count, and
+# print the throughput and the speedup over one worker. Returns a list of
+# (workers, seconds) tuples
+def time_worker_counts(name: str, func, tasks: list, worker_counts: list, chunk_size=8):
+    results = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        # Consume the results, since run_tasks is lazy
+        for _ in parallel.run_tasks(func, tasks, workers, chunk_size):
+            pass
+        seconds = time.perf_counter() - start
+        results.append((workers, seconds))
+
+        speedup = results[0][1] / seconds
+        print(f"{name}: {workers} workers, {len(tasks) / seconds:.1f} tasks/s, {speedup:.2f}x")
+    return results
+
+# Benchmark how sensor cropping and the per-sensor RGB statistics scale with the
+# number of worker processes. worker_counts defaults to powers of 2 up to the
+# number of CPUs
+def bench_parallel_scaling(worker_counts=None):
+    if worker_counts is None:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= os.cpu_count():
+            worker_counts.append(worker_counts[-1] * 2)
+
+    # RGB statistics of every bundled sensor image
+    stats_tasks = [(file_name, "PRISTINE") for file_name in sorted(os.listdir("Imgscans_PRISTINE_sensors"))]
+    stats_tasks += [(file_name, "EXPOSED") for file_name in sorted(os.listdir("Imgscans_EXPOSED_sensors"))]
+    time_worker_counts("RGB statistics", adds.get_channel_means, stats_tasks, worker_counts)
+
+    # Crop four sensors out of each pristine board, written to a temporary
+    # directory so the real sensor images are untouched
+    coords = {"x1": 0.1, "x2": 0.3, "y1": 0.1, "y2": 0.3}
+    with tempfile.TemporaryDirectory() as output_dir:
+        crop_tasks = [
+            (file_name, "PRISTINE", [(f"{output_dir}/{file_name.split(".")[0]}_{sensor}.jpg", coords) for sensor in ["U1", "U2", "U3", "U4"]])
+            for file_name in sorted(os.listdir("Imgscans_PRISTINE_edited"))
+        ]
+        time_worker_counts("Board cropping", generators.crop_board_image, crop_tasks, worker_counts, chunk_size=1)
+
+# Get the memory used by a DataFrame, or by every DataFrame in a tuple, in bytes
+def get_memory_usage(view):
+    if isinstance(view, tuple):
+        return sum(get_memory_usage(df) for df in view)
+    return view.memory_usage(deep=True).sum()
+
+# Report the memory used by each adds view when loaded with pandas' default data
+# types, and with the compact data types declared in reads. Returns a DataFrame
+# of megabytes, indexed by view
+def report_memory():
+    views = {
+        "get_master": lambda: adds.get_master(),
+        "get_master (dendrite score)": lambda: adds.get_master(dendrite_score_col=True),
+        "get_master_cf_or_cv (CF)": lambda: adds.get_master_cf_or_cv("CF"),
+        "get_master_cf_or_cv (CV)": lambda: adds.get_master_cf_or_cv("CV"),
+        "get_master_current_time": lambda: adds.get_master_current_time(),
+        "get_current_time_narrow": lambda: adds.get_current_time_narrow()
+    }
+
+    compact_dtypes = reads.compact_dtypes
+    report = pd.DataFrame(index=list(views), columns=["Before (MB)", "After (MB)"], dtype=float)
+    try:
+        for col, compact in [("Before (MB)", False), ("After (MB)", True)]:
+            reads.compact_dtypes = compact
+            for name, get_view in views.items():
+                report.at[name, col] = get_memory_usage(get_view()) / 1e6
+    finally:
+        reads.compact_dtypes = compact_dtypes
+
+    report["Reduction"] = report["Before (MB)"] / report["After (MB)"]
+    print(report.round(2).to_string())
+    return report
+
+# Rename the board in board IDs and file names, such as 03_01_0001 or
+# 03_01_0001_U1_20240411_CF_0.csv, by adding offset to its serial number. Values
+# that aren't board IDs or file names, such as NaN, are left as they are
+def offset_board_id(values: pd.Series, offset: int):
+    is_str = values.map(lambda value: isinstance(value, str))
+    renamed = values[is_str].str.replace(
+        r"^([^_]+_[^_]+_)(\d+)",
+        lambda match: f"{match[1]}{int(match[2]) + offset:04d}",
+        regex=True
+    )
+    return values.astype(object).where(~is_str, renamed)
+
+# Get stand ins for the exposed board images, which aren't bundled, as a dict
+# of exposed board image file name -> pristine board image file name. Each
+# board with exposed sensor images and dated master rows, which
+# gen_sensor_images needs, gets its pattern's pristine board image
+def get_exposed_stand_ins(master: pd.DataFrame):
+    pattern_to_board = {file_name.split("_")[1]: file_name for file_name in sorted(os.listdir("Imgscans_PRISTINE_edited"))}
+    dated = set(master.dropna(subset=["Board ID", "Date", "Sensor"])["Board ID"])
+    exposed = {"_".join(file_name.split("_")[:3]) for file_name in os.listdir("Imgscans_EXPOSED_sensors")}
+    board_ids = sorted(board_id for board_id in exposed & dated if board_id.split("_")[1] in pattern_to_board)
+    return {f"{board_id}_001.jpg": pattern_to_board[board_id.split("_")[1]] for board_id in board_ids}
+
+# Generate a synthetic dataset in output_dir with scale copies of every board in
+# the bundled dataset. Each copy's boards are given new serial numbers, and its
+# masterlist rows, measurement files, and exposed images are renamed to match,
+# so the dataset has scale times the boards, sensors, and files. Pristine
+# images are joined by pattern, not board, so they're only copied once, (see
+# PRISTINE_DIRS). Copy 0 keeps the original names, so scale=1 is a copy of the
+# bundled dataset. There are no exposed board images, so pristine ones stand
+# in for them, (see get_exposed_stand_ins), which lets gen_sensor_images crop
+# both ages. Files that are only read are hard linked where possible, to save
+# disk space
+def gen_synthetic_dataset(output_dir: str, scale=10):
+    # Copy each file under a new name, in place of reading and rewriting it. The
+    # sensor images are always copied, because gen_sensor_images overwrites
+    # them, which would write through a hard link into the bundled dataset
+    def copy_file(source_path: str, output_path: str, link: bool):
+        try:
+            if link:
+                os.link(source_path, output_path)
+                return
+        except OSError:
+            pass
+        shutil.copyfile(source_path, output_path)
+
+    masterlist = reads.get_masterlist_path()
+    master = pd.read_csv(masterlist, dtype=str)
+    copies = [] # Masterlist rows of every copy
+    for copy in range(scale):
+        offset = copy * 10000
+        copy_master = master.copy()
+        for col in BOARD_COLS:
+            copy_master[col] = offset_board_id(copy_master[col], offset)
+        copies.append(copy_master)
+    os.makedirs(output_dir, exist_ok=True)
+    pd.concat(copies, ignore_index=True).to_csv(f"{output_dir}/{masterlist}", index=False)
+
+    for dir in DATASET_DIRS:
+        os.makedirs(f"{output_dir}/{dir}", exist_ok=True)
+
+        # Exposed board images stand in from the pristine ones if missing
+        if dir == "Imgscans_EXPOSED_edited" and not os.path.isdir(dir):
+            stand_ins = get_exposed_stand_ins(master)
+            source_dir, file_names, names = "Imgscans_PRISTINE_edited", list(stand_ins.values()), pd.Series(list(stand_ins))
+        elif os.path.isdir(dir):
+            source_dir, file_names = dir, sorted(os.listdir(dir))
+            names = pd.Series(file_names)
+        else:
+            continue
+
+        for copy in range(1 if dir in PRISTINE_DIRS else scale):
+            output_names = offset_board_id(names, copy * 10000)
+            for file_name, output_name in zip(file_names, output_names):
+                copy_file(f"{source_dir}/{file_name}", f"{output_dir}/{dir}/{output_name}", link=not dir.endswith("_sensors"))
+
+# Forget everything generated or cached from a dataset, on disk and in memory,
+# so the next step runs as if on a fresh checkout
+def reset_dataset_caches():
+    reads._file_index = None
+    reads._store.clear()
+    reads._lod_store.clear()
+    for path in [reads.STORE_DIR, adds.IMAGE_STATS_CACHE, generators.SENSOR_MANIFEST, dendrite_maps.TILE_CACHE, generators.BOARD_TRANSFORMS]:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.isfile(path):
+            os.remove(path)
+
+# Get the number of rows of a step's result, or None if it isn't a DataFrame
+def get_rows(result):
+    if isinstance(result, tuple):
+        return sum(get_rows(df) for df in result)
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    return None
+
+# The pipeline steps timed by bench_pipeline, as name -> function
+PIPELINE_STEPS = {
+    "get_master": lambda: adds.get_master(),
+    "get_master (dendrite score)": lambda: adds.get_master(dendrite_score_col=True),
+    "get_master_cf_or_cv (CF)": lambda: adds.get_master_cf_or_cv("CF"),
+    "get_master_cf_or_cv (CV)": lambda: adds.get_master_cf_or_cv("CV"),
+    "get_master_current_time": lambda: adds.get_master_current_time(),
+    "gen_sensor_images": lambda: generators.gen_sensor_images()
+}
+
+# Time and memory profile each pipeline step on the dataset in dataset_dir. Each
+# step is timed repeat times from cold caches, keeping the fastest, then run
+# once more under tracemalloc for its peak memory, which is kept out of the
+# timing since tracing slows it down. Returns a list of result dicts
+def bench_dataset(dataset_dir: str, dataset: str, repeat=3):
+    results = []
+    cwd = os.getcwd()
+    os.chdir(dataset_dir)
+    try:
+        for step, run_step in PIPELINE_STEPS.items():
+            times = []
+            for _ in range(repeat):
+                reset_dataset_caches()
+                start = time.perf_counter()
+                result = run_step()
+                times.append(time.perf_counter() - start)
+
+            reset_dataset_caches()
+            tracemalloc.start()
+            run_step()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results.append({
+                "Dataset": dataset,
+                "Step": step,
+                "Seconds": min(times),
+                "Peak Memory (MB)": peak / 1e6,
+                "Rows": get_rows(result)
+            })
+            print(f"{dataset}, {step}: {min(times):.3f} s, {peak / 1e6:.1f} MB peak")
+        reset_dataset_caches()
+    finally:
+        os.chdir(cwd)
+        reads._file_index = None
+        reads._store.clear()
+
+    return results
+
+# Benchmark the reads -> adds pipeline and sensor image generation on the
+# bundled dataset, and on synthetic datasets with each of scales times its
+# boards. Every dataset is a generated copy, so the bundled data is never
+# changed. The results are written as JSON to BENCH_RESULTS_DIR, with the
+# commit and machine they were measured on, for compare_bench_results. The 100x
+# dataset takes a long time, so pass scales=[10] for a quick check. Returns the
+# results file's path
+def bench_pipeline(scales=[10, 100], repeat=3):
+    results = []
+    for scale in [1, *scales]:
+        dataset = "bundled" if scale == 1 else f"synthetic x{scale}"
+        with tempfile.TemporaryDirectory() as dataset_dir:
+            print(f"Generating {dataset} dataset")
+            gen_synthetic_dataset(dataset_dir, scale)
+            for result in bench_dataset(dataset_dir, dataset, repeat):
+                results.append({**result, "Scale": scale})
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    run = {
+        "Timestamp": timestamp,
+        "Commit": commit,
+        "Python": platform.python_version(),
+        "Pandas": pd.__version__,
+        "Machine": platform.platform(),
+        "CPUs": os.cpu_count(),
+        "Repeat": repeat,
+        "Results": results
+    }
+
+    os.makedirs(BENCH_RESULTS_DIR, exist_ok=True)
+    results_path = f"{BENCH_RESULTS_DIR}/{timestamp}_{commit or "unknown"}.json"
+    with open(results_path, "w") as file:
+        json.dump(run, file, indent=2)
+    print(f"Results written to {results_path}")
+
+    return results_path
+
+# Read a results file written by bench_pipeline as a DataFrame
+def read_bench_results(results_path: str):
+    with open(results_path) as file:
+        return pd.DataFrame(json.load(file)["Results"])
+
+# Compare two results files written by bench_pipeline, printing each step's
+# time and peak memory in both, and the ratio of new to old. A ratio above 1 is
+# a slowdown. Returns the comparison as a DataFrame
+def compare_bench_results(old_path: str, new_path: str):
+    keys = ["Dataset", "Step"]
+    comparison = read_bench_results(old_path).merge(
+        read_bench_results(new_path),
+        on=keys, how="outer", suffixes=(" Old", " New")
+    ).set_index(keys)
+    for col in ["Seconds", "Peak Memory (MB)"]:
+        comparison[f"{col} Ratio"] = comparison[f"{col} New"] / comparison[f"{col} Old"]
+
+    cols = [f"{col} {version}" for col in ["Seconds", "Peak Memory (MB)"] for version in ["Old", "New", "Ratio"]]
+    print(comparison[cols].round(3).to_string())
+    return comparison[cols]
+
+# The mean R, G, and B values of a sensor image as they were computed before the
+# statistics only path, with an RGB copy and a copy of each channel. Kept as the
+# reference that bench_image_reads compares against
+def get_channel_means_by_split(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"]):
+    image = reads.get_sensor_image(file_name, age)
+    if image is None:
+        return None
+    r, g, b = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return np.mean(r), np.mean(g), np.mean(b)
+
+# Run func on each task, returning the results, the seconds taken, and the peak
+# memory in bytes. Memory is measured in a second run under tracemalloc, since
+# tracing slows it down
+def time_and_trace(func, tasks: list):
+    start = time.perf_counter()
+    results = [func(*task) for task in tasks]
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    for task in tasks:
+        func(*task)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return results, seconds, peak
+
+# Get the dendrite score of every sensor in master, given a list of (file name,
+# age) images and their means, the way adds.add_dendrite_score scores them
+def get_dendrite_scores(images: list, means: list):
+    stats = pd.DataFrame(
+        [(file_name, age, *image_means) for (file_name, age), image_means in zip(images, means) if image_means is not None],
+        columns=["File Name", "Age", "R", "G", "B"]
+    )
+    master = adds.get_master()
+    for age in ["PRISTINE", "EXPOSED"]:
+        age_stats = stats[stats["Age"] == age].drop(columns="Age").set_index("File Name")
+        for channel in ["R", "G", "B"]:
+            master[f"{channel}_{age}"] = master[f"Image_{age}"].map(age_stats[channel]).astype(float)
+    return np.sqrt(sum((master[f"{channel}_EXPOSED"] - master[f"{channel}_PRISTINE"])**2 for channel in ["R", "G", "B"]))
+
+# Benchmark the image reading paths against the full size path they replace:
+#   - Sensor image means, by the old RGB split, and by the statistics only path
+#     at each reduce factor, with how far the means and dendrite scores drift
+#     from the old path
+#   - Board image decodes at each reduce factor
+# Prints and returns a DataFrame of the results
+def bench_image_reads(reduces=[1, 2, 4, 8]):
+    rows = []
+
+    # Sensor image means
+    images = [(file_name, "PRISTINE") for file_name in sorted(os.listdir("Imgscans_PRISTINE_sensors"))]
+    images += [(file_name, "EXPOSED") for file_name in sorted(os.listdir("Imgscans_EXPOSED_sensors"))]
+    reference, seconds, peak = time_and_trace(get_channel_means_by_split, images)
+    rows.append({"Path": "Sensor means, RGB split", "Reduce": 1, "Images/s": len(images) / seconds, "Peak Memory (MB)": peak / 1e6})
+    reference_scores = get_dendrite_scores(images, reference)
+
+    for reduce in reduces:
+        means, seconds, peak = time_and_trace(adds.get_channel_means, [(*image, reduce) for image in images])
+        scores = get_dendrite_scores(images, means)
+        rows.append({
+            "Path": "Sensor means, statistics only", "Reduce": reduce,
+            "Images/s": len(images) / seconds, "Peak Memory (MB)": peak / 1e6,
+            "Max Mean Drift": np.max(np.abs(np.array(means) - np.array(reference))),
+            "Max Score Drift": (scores - reference_scores).abs().max(),
+            "Mean Score Drift": (scores - reference_scores).abs().mean()
+        })
+
+    # Board image decodes
+    boards = [(file_name, "PRISTINE") for file_name in sorted(os.listdir("Imgscans_PRISTINE_edited"))]
+    for reduce in reduces:
+        _, seconds, peak = time_and_trace(reads.get_board_image, [(*board, reduce) for board in boards])
+        rows.append({"Path": "Board decode", "Reduce": reduce, "Images/s": len(boards) / seconds, "Peak Memory (MB)": peak / 1e6})
+
+    results = pd.DataFrame(rows)
+    print(results.to_string(index=False))
+    return results
+
+# Run Area ---------------------------------------------------------------------
+# Uncomment lines to run the benchmarks
+
+if __name__ == "__main__":
+    bench_parallel_scaling()
+    # report_memory()
+    # bench_pipeline()
+    # bench_image_reads()
@@ -3,21 +3,30 @@
 # joined data from cleans.py.
 
 import adds
+import lod
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-# Get joined data
-master_current_time = adds.get_master_current_time()
+# Each facet is FacetGrid's default of 3 inches wide, so the traces are read at
+# the level of detail with a bucket for each of its pixels
+buckets = lod.choose_buckets(3 * plt.rcParams["figure.dpi"])
 
-# Add a unique sensor identifier
-master_current_time["Sensor ID"] = master_current_time["Board ID"] + "_" + master_current_time["Sensor"]
+# Get the plotted data one voltage at a time, as (voltage, data). The joined
+# data is read one voltage at a time, with only the master columns that are
+# plotted, to keep memory use low. master is used instead of get_master() if
+# given
+def iter_current_time_data(master=None):
+    for voltage, master_current_time in adds.iter_master_current_time(group_by="Voltage", master_cols=["Board ID", "Sensor", "Pattern", "Solution"], master=master, buckets=buckets):
+        # Add a unique sensor identifier
+        master_current_time["Sensor ID"] = master_current_time["Board ID"].astype(str) + "_" + master_current_time["Sensor"].astype(str)
+        yield voltage, master_current_time
 
 # Plot Data --------------------------------------------------------------------
-# Plot for each unique voltage
-for voltage in master_current_time["Voltage"].unique():
+# Plot one voltage's data from iter_current_time_data, returning the figure
+def plot_current_time(voltage_data, voltage):
     # Create a FacetGrid
     g = sns.FacetGrid(
-        data=master_current_time[master_current_time["Voltage"] == voltage],
+        data=voltage_data,
         row="Pattern", row_order=[1, 4, 7, 10],
         col="Solution", col_order=["DI Water", "Adipic Acid - 0.388mM", "Adipic Acid - 0.712mM", "Adipic Acid - 1.24mM", "Succinic 0.388mM", "Succinic 0.712 mM", "Succinic 1.425mM", "Succinic 3.6mM"],
         hue="Sensor", palette={"U1":"#FF0000", "U2":"#B6FF00", "U3":"#00FFFF", "U4":"#7F00FF"},
@@ -62,4 +71,10 @@ for voltage in master_current_time["Voltage"].unique():
     # Add main title
     g.figure.suptitle(f"Current Vs Time, by Solution, Pattern, and Sensor ({int(voltage)}V)")
 
-    plt.show()
+    return g.figure
+
+if __name__ == "__main__":
+    # Plot for each unique voltage
+    for voltage, voltage_data in iter_current_time_data():
+        plot_current_time(voltage_data, voltage)
+        plt.show()
@@ -0,0 +1,244 @@
+# Spatial maps of dendrite growth. Each sensor image is split into a grid of
+# tiles, and each tile of the exposed image is compared with the same tile of the
+# pristine image, rather than comparing the whole images' mean colors. This shows
+# where on the sensor growth happened, and whether it follows the comb's edges.
+#
+# Sample use:
+#   maps, edges = dendrite_maps.get_dendrite_maps(master)
+#   plt.imshow(maps[0]) # Heatmap of master's first row
+
+import reads
+import parallel
+import instrument
+import cv2
+import numpy as np
+import pandas as pd
+import os
+import typing
+
+# Cache of the tiles of sensor images, used by get_sensor_tiles
+TILE_CACHE = "Imgscans_sensors_tiles.npz"
+
+# Tiles per sensor image, as (rows, columns). The grid is in fractions of the
+# image, so images of different sizes, such as pristine and exposed crops, line
+# up tile for tile
+GRID = (16, 16)
+
+# Tile delta, a distance in RGB values, above which a tile counts as affected.
+# This is about the 90th percentile of tile deltas in the bundled images, since
+# most tiles differ by some amount from lighting alone
+AFFECTED_DELTA = 40.0
+# Quantile of edge strength at or above which a tile is on the comb's edges
+EDGE_QUANTILE = 0.75
+
+# Get the tiles of a sensor image, as an array of (rows, columns, 4), or None if
+# it couldn't be read. Each tile has its mean R, G, and B values, and for
+# pristine images, its mean edge strength, the gradient magnitude of the
+# grayscale image, which is high on the comb's edges. Exposed images have NaN
+# edge strengths, since only the pristine comb's edges are used. Tile means are
+# taken by area resizing the image down to the grid, which averages each tile's
+# pixels in one pass. This is at the top level so that worker processes can run
+# it
+@instrument.stage("dendrite_maps.get_tiles")
+def get_tiles(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"], grid=GRID, reduce=1):
+    image = reads.get_sensor_image(file_name, age, reduce)
+    if image is None:
+        return None
+    rows, cols = grid
+
+    # BGR to RGB of the tile means, rather than of the whole image
+    color = cv2.resize(image, (cols, rows), interpolation=cv2.INTER_AREA if image.shape[0] >= rows and image.shape[1] >= cols else cv2.INTER_LINEAR)
+    color = color[:, :, ::-1].astype(np.float32)
+
+    # Gradient magnitude of the pristine comb
+    if age != "PRISTINE":
+        return np.dstack([color, np.full((rows, cols), np.nan, dtype=np.float32)])
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    magnitude = cv2.magnitude(cv2.Sobel(gray, cv2.CV_32F, 1, 0), cv2.Sobel(gray, cv2.CV_32F, 0, 1))
+    edge = cv2.resize(magnitude, (cols, rows), interpolation=cv2.INTER_AREA)
+
+    return np.dstack([color, edge])
+
+# Read the tile cache as a dict of path -> entry. Tiles made with a different grid
+# or reduce can't be used, so they're left out
+def read_tile_cache(grid=GRID, reduce=1):
+    if not os.path.isfile(TILE_CACHE):
+        return {}
+    with np.load(TILE_CACHE) as cache:
+        if tuple(cache["Grid"]) != tuple(grid) or int(cache["Reduce"]) != reduce:
+            return {}
+        return {
+            path: {"Path": path, "Size": size, "Mtime": mtime, "Hash": content_hash, "Tiles": tiles}
+            for path, size, mtime, content_hash, tiles in zip(cache["Path"], cache["Size"], cache["Mtime"], cache["Hash"], cache["Tiles"])
+        }
+
+# Write the tile cache, given a dict of path -> entry
+def write_tile_cache(path_to_entry: dict, grid=GRID, reduce=1):
+    entries = list(path_to_entry.values())
+    np.savez(
+        TILE_CACHE,
+        Grid=np.array(grid), Reduce=np.array(reduce),
+        Path=np.array([entry["Path"] for entry in entries], dtype=str),
+        Size=np.array([entry["Size"] for entry in entries], dtype=np.int64),
+        Mtime=np.array([entry["Mtime"] for entry in entries], dtype=np.int64),
+        Hash=np.array([entry["Hash"] for entry in entries], dtype=str),
+        Tiles=np.array([entry["Tiles"] for entry in entries], dtype=np.float32).reshape(len(entries), *grid, 4)
+    )
+
+# Get the tiles of sensor images, given a list of (file name, age). Tiles are
+# cached by the image's contents like adds.get_image_stats, so an image is only
+# read again after it changes. Uncached images are computed together, with
+# workers and chunk_size passed to parallel.run_tasks. Returns a dict of (file
+# name, age) -> tiles, for the images that could be read
+@instrument.stage("dendrite_maps.get_sensor_tiles")
+def get_sensor_tiles(images: list, grid=GRID, workers=1, chunk_size=8, reduce=1):
+    path_to_entry = read_tile_cache(grid, reduce)
+    # Keyed by the image's directory too, since pristine and exposed tiles of
+    # the same image differ, (see get_tiles)
+    hash_to_entry = {(entry["Hash"], os.path.dirname(entry["Path"])): entry for entry in path_to_entry.values()}
+
+    image_to_tiles = {}
+    uncached = [] # Images that need their tiles computed
+    changed = False # Whether the cache needs to be written
+
+    for file_name, age in images:
+        path = f"Imgscans_{age}_sensors/{file_name}"
+        if not os.path.isfile(path):
+            continue
+
+        # An unchanged size and modified time means an unchanged image
+        stat = os.stat(path)
+        entry = path_to_entry.get(path)
+        if entry is not None and entry["Size"] == stat.st_size and entry["Mtime"] == stat.st_mtime_ns:
+            image_to_tiles[(file_name, age)] = entry["Tiles"]
+            continue
+
+        # Otherwise look the image up by its contents
+        content_hash = reads.file_hash(path)
+        entry = hash_to_entry.get((content_hash, os.path.dirname(path)))
+        if entry is not None:
+            image_to_tiles[(file_name, age)] = entry["Tiles"]
+            path_to_entry[path] = {**entry, "Path": path, "Size": stat.st_size, "Mtime": stat.st_mtime_ns}
+            changed = True
+            continue
+
+        uncached.append((file_name, age, path, stat, content_hash))
+
+    # Compute all uncached images in one batch
+    tasks = [(file_name, age, grid, reduce) for file_name, age, _, _, _ in uncached]
+    for (file_name, age, path, stat, content_hash), tiles in zip(uncached, parallel.run_tasks(get_tiles, tasks, workers, chunk_size)):
+        # Skip images that couldn't be read
+        if tiles is None:
+            continue
+        image_to_tiles[(file_name, age)] = tiles
+        path_to_entry[path] = {"Path": path, "Size": stat.st_size, "Mtime": stat.st_mtime_ns, "Hash": content_hash, "Tiles": tiles}
+        changed = True
+
+    if changed:
+        write_tile_cache(path_to_entry, grid, reduce)
+
+    return image_to_tiles
+
+# Get the dendrite map of every master row, given master with Image_PRISTINE
+# and Image_EXPOSED columns, as from adds.get_master(). Returns a tuple of (maps,
+# edges), arrays of (rows of master, grid rows, grid columns) in master's order:
+#   - maps: each tile's delta, the distance between its exposed and pristine
+#     mean RGB values, like the dendrite score of a whole image
+#   - edges: each tile's edge strength in the pristine image, scaled so each
+#     sensor's strongest tile is 1
+# Rows without both images are NaN. grid, workers, chunk_size, and reduce are
+# passed to get_sensor_tiles
+@instrument.stage("dendrite_maps.get_dendrite_maps")
+def get_dendrite_maps(master: pd.DataFrame, grid=GRID, workers=1, chunk_size=8, reduce=1):
+    # Each pristine image is shared by many rows, so get each unique image
+    # only once
+    images = list(dict.fromkeys(
+        (file_name, age)
+        for age in ["PRISTINE", "EXPOSED"]
+        for file_name in master[f"Image_{age}"]
+        if isinstance(file_name, str)
+    ))
+    image_to_tiles = get_sensor_tiles(images, grid, workers, chunk_size, reduce)
+
+    # Stack every row's tiles, with NaN tiles for missing images
+    missing = np.full((*grid, 4), np.nan, dtype=np.float32)
+    def stack_tiles(age: typing.Literal["EXPOSED", "PRISTINE"]):
+        tiles = [image_to_tiles.get((file_name, age), missing) for file_name in master[f"Image_{age}"]]
+        return np.array(tiles, dtype=np.float32).reshape(len(master), *grid, 4)
+    pristine = stack_tiles("PRISTINE")
+    exposed = stack_tiles("EXPOSED")
+
+    # All rows at once
+    maps = np.sqrt(np.sum((exposed[..., :3] - pristine[..., :3])**2, axis=-1))
+    edges = pristine[..., 3]
+    strongest = np.max(np.nan_to_num(edges), axis=(1, 2), keepdims=True, initial=0)
+    edges = edges / np.where(strongest > 0, strongest, np.nan)
+    edges[np.isnan(maps)] = np.nan
+
+    return maps, edges
+
+# Summarize dendrite maps as a DataFrame with a row per map, indexed by index:
+#   - Affected Fraction: fraction of tiles with a delta over affected_delta
+#   - Max Tile Delta: largest tile delta
+#   - Mean Tile Delta: mean tile delta
+#   - Edge Tile Delta: mean tile delta of the tiles on the comb's edges, those
+#     at or above the EDGE_QUANTILE of their sensor's edge strengths. Above the
+#     Mean Tile Delta when growth follows the edges
+#   - Edge Affected Fraction: Affected Fraction of the tiles on the comb's edges
+# Rows without a map are NaN
+def summarize_dendrite_maps(maps: np.ndarray, edges: np.ndarray, index=None, affected_delta=AFFECTED_DELTA):
+    n = len(maps)
+    flat_maps = maps.reshape(n, -1)
+    flat_edges = edges.reshape(n, -1)
+    has_map = ~np.isnan(flat_maps).all(axis=1)
+
+    # Reduce each row, leaving rows without a map as NaN
+    def reduce_rows(func, values, **kwargs):
+        result = np.full(n, np.nan)
+        result[has_map] = func(values[has_map], axis=1, **kwargs)
+        return result
+
+    affected = flat_maps > affected_delta
+    on_edge = flat_edges >= reduce_rows(np.quantile, flat_edges, q=EDGE_QUANTILE)[:, None]
+    summary = pd.DataFrame({
+        "Affected Fraction": reduce_rows(np.mean, affected),
+        "Max Tile Delta": reduce_rows(np.max, flat_maps),
+        "Mean Tile Delta": reduce_rows(np.mean, flat_maps),
+        "Edge Tile Delta": reduce_rows(np.sum, np.where(on_edge, flat_maps, 0)) / reduce_rows(np.sum, on_edge),
+        "Edge Affected Fraction": reduce_rows(np.sum, affected & on_edge) / reduce_rows(np.sum, on_edge)
+    }, index=index)
+
+    return summary
+
+# Add the dendrite map summary columns of summarize_dendrite_maps to master,
+# returning a new DataFrame. grid, workers, chunk_size, and reduce are passed to
+# get_dendrite_maps
+def add_dendrite_map_cols(master: pd.DataFrame, grid=GRID, workers=1, chunk_size=8, reduce=1, affected_delta=AFFECTED_DELTA):
+    maps, edges = get_dendrite_maps(master, grid, workers, chunk_size, reduce)
+    return master.join(summarize_dendrite_maps(maps, edges, master.index, affected_delta))
+
+# Plot a sensor's pristine image, exposed image, and dendrite map side by side,
+# given master and maps from get_dendrite_maps, and the position of the sensor's
+# row in master
+def plot_dendrite_map(master: pd.DataFrame, maps: np.ndarray, position: int):
+    import matplotlib.pyplot as plt
+
+    row = master.iloc[position]
+    fig, axes = plt.subplots(1, 3, figsize=(12, 4))
+    extent = None # Image bounds, so the map is stretched over the same shape
+    for ax, age in zip(axes, ["PRISTINE", "EXPOSED"]):
+        image = reads.get_sensor_image(row[f"Image_{age}"], age)
+        if image is not None:
+            ax.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            extent = (0, image.shape[1], image.shape[0], 0)
+        ax.set_title(age.title())
+        ax.axis("off")
+
+    heatmap = axes[2].imshow(maps[position], cmap="inferno", extent=extent)
+    axes[2].set_title("Tile Delta")
+    axes[2].axis("off")
+    fig.colorbar(heatmap, ax=axes[2])
+    fig.suptitle(f"{row["Board ID"]} {row["Sensor"]}")
+    fig.tight_layout()
+
+    return fig
@@ -1,43 +1,58 @@
+# Plot the change in each color channel of sensor images, from pristine to
+# exposed, by pattern.
+
 import adds
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-master = adds.get_master(dendrite_score_col=True)
-
-# Add columns for RGB difference
-master["Red"] = master["R_EXPOSED"] - master["R_PRISTINE"]
-master["Green"] = master["G_EXPOSED"] - master["G_PRISTINE"]
-master["Blue"] = master["B_EXPOSED"] - master["B_PRISTINE"]
-
-# Convert to long for easy plotting
-master = pd.melt(
-    master,
-    id_vars=["Board ID", "Sensor", "Pattern"],
-    value_vars=["Red", "Green", "Blue"], # Possible values stored in Channel column
-    var_name="Channel", # A channel column will be added, storing "R_Diff"...
-    value_name="Channel Difference" # This column will be added, storing a number
-)
-
-# Create a FacetGrid
-g = sns.FacetGrid(
-    data=master,
-    col="Channel",
-    margin_titles=True,
-    hue="Channel",
-    palette={"Red": "#FF0000", "Green": "#00FF00", "Blue": "#0000FF"}
-)
-
-# Create a lineplot on the FacetGrid
-g.map_dataframe(
-    sns.boxplot,
-    x="Pattern", y="Channel Difference",
-)
-
-# Set the text of the titles
-g.set_titles(col_template="{col_name}")
-
-# Set ticks to ints, not floats
-g.set_xticklabels([1, 4, 7, 10])
-
-plt.show()
+# Get the plotted data, each sensor's channel differences in long form. master
+# is used instead of get_master(dendrite_score_col=True) if given, and must
+# have its dendrite score columns
+def get_channel_differences(master=None):
+    if master is None:
+        master = adds.get_master(dendrite_score_col=True)
+    master = master.copy()
+
+    # Add columns for RGB difference
+    master["Red"] = master["R_EXPOSED"] - master["R_PRISTINE"]
+    master["Green"] = master["G_EXPOSED"] - master["G_PRISTINE"]
+    master["Blue"] = master["B_EXPOSED"] - master["B_PRISTINE"]
+
+    # Convert to long for easy plotting
+    return pd.melt(
+        master,
+        id_vars=["Board ID", "Sensor", "Pattern"],
+        value_vars=["Red", "Green", "Blue"], # Possible values stored in Channel column
+        var_name="Channel", # A channel column will be added, storing "R_Diff"...
+        value_name="Channel Difference" # This column will be added, storing a number
+    )
+
+# Plot the data from get_channel_differences, returning the figure
+def plot_channel_differences(channel_differences):
+    # Create a FacetGrid
+    g = sns.FacetGrid(
+        data=channel_differences,
+        col="Channel",
+        margin_titles=True,
+        hue="Channel",
+        palette={"Red": "#FF0000", "Green": "#00FF00", "Blue": "#0000FF"}
+    )
+
+    # Create a lineplot on the FacetGrid
+    g.map_dataframe(
+        sns.boxplot,
+        x="Pattern", y="Channel Difference",
+    )
+
+    # Set the text of the titles
+    g.set_titles(col_template="{col_name}")
+
+    # Set ticks to ints, not floats
+    g.set_xticklabels([1, 4, 7, 10])
+
+    return g.figure
+
+if __name__ == "__main__":
+    plot_channel_differences(get_channel_differences())
+    plt.show()
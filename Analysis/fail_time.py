@@ -4,21 +4,26 @@ import adds
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-# Get master data
-master = adds.get_master()
+# Get the rows of master that are plotted, with a column for failure time in
+# seconds. master is used instead of get_master() if given
+def get_fail_time_data(master=None):
+    if master is None:
+        master = adds.get_master()
 
-# Drop NaN rows
-master.dropna(subset="Voltage", inplace=True)
+    # Drop NaN rows
+    master = master.dropna(subset="Voltage").copy()
 
-# Add column to store failure time in seconds
-master["Failure Time (s)"] = master["Time to Failure (ms)"] / 1000
+    # Add column to store failure time in seconds
+    master["Failure Time (s)"] = master["Time to Failure (ms)"] / 1000
+    return master
 
 # Plot Data --------------------------------------------------------------------
-# Plot for each unique voltage
-for voltage in master["Voltage"].unique():
+# Plot one voltage's rows of the data from get_fail_time_data, returning the
+# figure
+def plot_fail_time(voltage_data, voltage):
     # Create a FacetGrid
     g = sns.FacetGrid(
-        data=master[master["Voltage"] == voltage],
+        data=voltage_data,
         row="Pattern", row_order=[1, 4, 7, 10],
         hue="Sensor", palette={"U1":"#FF0000", "U2":"#B6FF00", "U3":"#00FFFF", "U4":"#7F00FF"},
         margin_titles=True,
@@ -61,4 +66,11 @@ for voltage in master["Voltage"].unique():
         top=0.94
     )
 
-    plt.show()
+    return g.figure
+
+if __name__ == "__main__":
+    # Plot for each unique voltage
+    data = get_fail_time_data()
+    for voltage in data["Voltage"].unique():
+        plot_fail_time(data[data["Voltage"] == voltage], voltage)
+        plt.show()
@@ -0,0 +1,167 @@
+# Detects when each sensor failed from its CurrentTime trace, rather than
+# relying on the hand entered "Time to Failure (ms)" in the masterlist. All
+# traces are scanned at once with NumPy, so this is cheap enough to rerun over
+# the whole archive whenever new files are added.
+
+import adds
+import reads
+import pandas as pd
+import numpy as np
+import os
+
+# Where the table from gen_detected_failures is stored
+DETECTED_FAILURES = f"{reads.STORE_DIR}/detected_failures.csv"
+
+# Get the first time each sensor's flag is True, as an array indexed by sensor
+# code, NaN where it never is
+def first_flagged_time(flag: np.ndarray, sensor: np.ndarray, time: np.ndarray, n_sensors: int):
+    first = pd.Series(time[flag]).groupby(sensor[flag]).min()
+    return first.reindex(range(n_sensors)).to_numpy()
+
+# Detect the failure of every sensor with a CurrentTime file. A sensor fails at
+# the earliest of:
+#   - Threshold: the current reaches threshold (mA)
+#   - Spike: the current stays at spike_factor times its baseline, the median of
+#     its first baseline_samples samples, for spike_samples samples in a row
+#   - Short: the current jumps by short_step (mA) or more in one sample. This
+#     is half the threshold by default, so a short can be told apart from a
+#     threshold crossing. Sample to sample steps are under 0.5 mA 99% of the
+#     time in the bundled traces. A jump that stays under the threshold only
+#     counts if the current never reaches the threshold later in the trace,
+#     since the threshold crossing is then the failure the masterlist records
+# Returns a DataFrame indexed like master, with the time of each criterion, the
+# detected failure time and mode, the peak current, and the leakage slope before
+# failure. The masterlist failure time is included for comparison, and
+# "Disagrees" is True when the two differ by more than tolerance, as a fraction
+# of the masterlist time, or only one of them exists. narrow is used instead of
+# adds.get_current_time_narrow() if given
+def detect_failures(threshold=5.0, spike_factor=10.0, baseline_samples=10, spike_samples=3, short_step=2.5, tolerance=0.05, narrow=None):
+    master, measurements = adds.get_current_time_narrow() if narrow is None else narrow
+
+    # Flat arrays of every sample, sorted by sensor then time
+    sensor = measurements["Master Index"].cat.codes.to_numpy()
+    time = measurements["Time (ms)"].to_numpy(dtype=float)
+    current = measurements["Current (mA)"].to_numpy(dtype=float)
+    order = np.lexsort((time, sensor))
+    sensor, time, current = sensor[order], time[order], current[order]
+    n_sensors = len(master)
+
+    # Where each sensor's samples start, and each sample's position in its trace
+    new_sensor = np.r_[True, sensor[1:] != sensor[:-1]]
+    starts = np.flatnonzero(new_sensor)
+    position = np.arange(len(sensor)) - np.repeat(starts, np.diff(np.r_[starts, len(sensor)]))
+
+    # Threshold crossing
+    threshold_time = first_flagged_time(current >= threshold, sensor, time, n_sensors)
+
+    # Sustained spike over the baseline. Runs of flagged samples are numbered,
+    # so each sample knows the length of the run it's in
+    baseline = pd.Series(current[position < baseline_samples]).groupby(sensor[position < baseline_samples]).median()
+    baseline = baseline.reindex(range(n_sensors)).to_numpy()
+    spiking = current >= spike_factor * baseline[sensor]
+    run_start = new_sensor | np.r_[True, spiking[1:] != spiking[:-1]]
+    run_id = np.cumsum(run_start) - 1
+    run_length = np.bincount(run_id)[run_id]
+    spike_time = first_flagged_time(spiking & run_start & (run_length >= spike_samples), sensor, time, n_sensors)
+
+    # Short circuit, a sudden jump in current within a sensor's trace
+    step = np.r_[0, np.diff(current)]
+    short_time = first_flagged_time((step >= short_step) & ~new_sensor, sensor, time, n_sensors)
+
+    # A short is only a failure if the current never reaches the threshold, or
+    # reaches it with the jump itself
+    counted_short_time = np.where(np.isnan(threshold_time) | (short_time >= threshold_time), short_time, np.nan)
+
+    # Earliest criterion wins. A short's jump often crosses the threshold or
+    # starts a spike at the same sample, so on ties Short comes first, then
+    # Threshold, then Spike
+    criteria_times = np.column_stack([counted_short_time, threshold_time, spike_time])
+    criteria_times = np.where(np.isnan(criteria_times), np.inf, criteria_times)
+    earliest = np.argmin(criteria_times, axis=1)
+    failure_time = criteria_times[np.arange(n_sensors), earliest]
+    has_failure = np.isfinite(failure_time)
+    failure_time = np.where(has_failure, failure_time, np.nan)
+    failure_mode = np.where(has_failure, np.array(["Short", "Threshold", "Spike"])[earliest], None)
+
+    # Leakage slope from samples before failure, as a least squares slope of
+    # current vs time, from per-sensor sums
+    before = time < np.where(np.isnan(failure_time), np.inf, failure_time)[sensor]
+    t, i = time[before] / 1000, current[before]
+    sums = pd.DataFrame({"t": t, "i": i, "ti": t * i, "tt": t * t}).groupby(sensor[before]).sum()
+    n = pd.Series(sensor[before]).groupby(sensor[before]).size()
+    slope = (n * sums["ti"] - sums["t"] * sums["i"]) / (n * sums["tt"] - sums["t"]**2)
+
+    failures = pd.DataFrame({
+        "Threshold Time (ms)": threshold_time,
+        "Spike Time (ms)": spike_time,
+        "Short Time (ms)": short_time,
+        "Detected Failure Time (ms)": failure_time,
+        "Failure Mode": failure_mode,
+        "Peak Current (mA)": pd.Series(current).groupby(sensor).max().reindex(range(n_sensors)).to_numpy(),
+        "Leakage Slope (mA/s)": slope.reindex(range(n_sensors)).to_numpy()
+    }, index=master.index)
+
+    # Only sensors with a CurrentTime file
+    failures = failures[np.bincount(sensor, minlength=n_sensors) > 0]
+
+    # Compare with the masterlist
+    failures.insert(0, "Board ID", master["Board ID"])
+    failures.insert(1, "Sensor", master["Sensor"])
+    failures.insert(2, "Status", master["Status"])
+    failures["Time to Failure (ms)"] = master["Time to Failure (ms)"]
+    failures["Failure Time Difference (ms)"] = failures["Detected Failure Time (ms)"] - failures["Time to Failure (ms)"]
+    detected = failures["Detected Failure Time (ms)"].notna()
+    listed = failures["Time to Failure (ms)"].notna()
+    failures["Disagrees"] = (detected != listed) | (failures["Failure Time Difference (ms)"].abs() > tolerance * failures["Time to Failure (ms)"])
+
+    return failures
+
+# Check that each criterion can be detected with the default settings, from
+# made up traces of sensors: one whose current climbs slowly past the threshold,
+# one that spikes over its baseline without reaching the threshold, one that
+# jumps in one sample without reaching the threshold, one whose jump crosses
+# the threshold, which is still a short, and one that jumps under the threshold
+# and then climbs past it, which is a threshold crossing. Raises an
+# AssertionError if any is detected as the wrong mode
+def check_failure_modes():
+    time = np.arange(40) * 1000.0
+    traces = [
+        ("Threshold", np.linspace(1.0, 6.0, 40)),
+        ("Spike", np.r_[np.full(20, 0.1), np.full(5, 2.0), np.full(15, 0.1)]),
+        ("Short", np.r_[np.full(20, 1.0), np.full(20, 4.0)]),
+        ("Short", np.r_[np.full(20, 1.0), np.full(20, 8.0)]),
+        ("Threshold", np.r_[np.full(10, 1.0), np.full(10, 4.0), np.linspace(4.0, 6.0, 20)])
+    ]
+    expected = [mode for mode, _ in traces]
+
+    master = pd.DataFrame({
+        "Board ID": "Check", "Sensor": [f"U{i + 1}" for i in range(len(traces))], "Status": "Failed", "Time to Failure (ms)": np.nan
+    })
+    measurements = pd.DataFrame({
+        "Master Index": pd.Categorical(np.repeat(master.index, len(time)), categories=master.index),
+        "Time (ms)": np.tile(time, len(traces)),
+        "Current (mA)": np.concatenate([current for _, current in traces])
+    })
+
+    modes = detect_failures(narrow=(master, measurements))["Failure Mode"].tolist()
+    assert modes == expected, f"Expected failure modes {expected}, detected {modes}"
+
+# Detect failures and store them, so other code can use them without scanning
+# the traces again. Rerun this after new CurrentTime files are added
+def gen_detected_failures(**detect_failures_kwargs):
+    os.makedirs(reads.STORE_DIR, exist_ok=True)
+    failures = detect_failures(**detect_failures_kwargs)
+    failures.to_csv(DETECTED_FAILURES, index_label="Master Index")
+
+    # Report sensors where detection and the masterlist disagree
+    disagreements = failures[failures["Disagrees"]]
+    print(f"Detected {failures["Detected Failure Time (ms)"].notna().sum()} failures of {len(failures)} sensors")
+    print(f"{len(disagreements)} disagree with the masterlist:")
+    print(disagreements[["Board ID", "Sensor", "Status", "Time to Failure (ms)", "Detected Failure Time (ms)", "Failure Mode"]].to_string())
+
+# Run Area ---------------------------------------------------------------------
+# Uncomment lines to run the generators
+
+if __name__ == "__main__":
+    # check_failure_modes()
+    gen_detected_failures()
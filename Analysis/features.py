@@ -0,0 +1,225 @@
+# Per-curve features of the capacitance vs voltage (CV) and capacitance vs
+# frequency (CF) sweeps, so analyses can work on one row per sensor instead of
+# every raw point. Features are computed for all curves at once, stored by
+# gen_curve_features, and joined to master by get_master_curve_features.
+
+import reads
+import adds
+import pandas as pd
+import numpy as np
+import os
+import tempfile
+import typing
+
+# Sweep points that capacitance is reported at, in volts for CV and hertz for CF
+REFERENCE_POINTS = {
+    "CV": [-2.0, 0.0, 2.0],
+    "CF": [1e3, 1e4, 1e5, 1e6]
+}
+
+# Columns of a stored feature table with the size and modified time of each
+# file when its features were computed, which gen_curve_features compares to
+# find changed files
+FILE_STAT_COLS = ["Size", "Mtime"]
+
+# Get a stored feature table's path
+def get_features_path(cf_or_cv: typing.Literal["CF", "CV"]):
+    return f"{reads.STORE_DIR}/{cf_or_cv}_features.csv"
+
+# Get every CF or CV file, (PRISTINE and EXPOSED), as one DataFrame with a File
+# Name column. file_names limits which files are read. Files that are missing,
+# empty, or quarantined are left out, so the DataFrame has no rows if no files
+# could be read
+def read_curves(cf_or_cv: typing.Literal["CF", "CV"], file_names=None):
+    curves = [] # List of every file's DataFrame
+    for age in ["PRISTINE", "EXPOSED"]:
+        for file_name in sorted(os.listdir(f"{cf_or_cv}/{cf_or_cv}_{age}")):
+            if file_names is not None and file_name not in file_names:
+                continue
+
+            # Read df, skipping if result is None
+            df = reads.get_cf_or_cv(file_name)
+            if df is None:
+                continue
+
+            df["File Name"] = file_name
+            curves.append(df)
+
+    if len(curves) == 0:
+        empty = {col: pd.Series(dtype="float64") for col in reads.MEASUREMENT_COLUMNS[cf_or_cv]}
+        return pd.DataFrame({**empty, "File Name": pd.Series(dtype=object)})
+    return pd.concat(curves, ignore_index=True)
+
+# Get the size and modified time of every CF or CV file, (PRISTINE and
+# EXPOSED), as a DataFrame indexed by File Name with FILE_STAT_COLS
+def get_curve_file_stats(cf_or_cv: typing.Literal["CF", "CV"]):
+    stats = [] # List of (file name, size, mtime)
+    for age in ["PRISTINE", "EXPOSED"]:
+        dir = f"{cf_or_cv}/{cf_or_cv}_{age}"
+        for file_name in sorted(os.listdir(dir)):
+            stat = os.stat(f"{dir}/{file_name}")
+            stats.append((file_name, stat.st_size, stat.st_mtime_ns))
+    return pd.DataFrame(stats, columns=["File Name", *FILE_STAT_COLS]).set_index("File Name").sort_index()
+
+# Compute the features of every curve at once, given all curves of a kind as
+# from read_curves. Returns a DataFrame with one row per file, indexed by File
+# Name. With file_names, there's a row for each of them instead, which is all
+# NaN for files read_curves left out
+def compute_curve_features(curves: pd.DataFrame, cf_or_cv: typing.Literal["CF", "CV"], file_names=None):
+    x_col = "Voltage (V)" if cf_or_cv == "CV" else "Frequency (Hz)"
+    unit = "V" if cf_or_cv == "CV" else "Hz"
+
+    by_file = curves.groupby("File Name", sort=True)
+    features = pd.DataFrame(index=by_file.size().index)
+
+    # Capacitance at the sweep point nearest each reference point, if the
+    # reference point is within the sweep
+    x_min = by_file[x_col].min()
+    x_max = by_file[x_col].max()
+    for point in REFERENCE_POINTS[cf_or_cv]:
+        nearest = (curves[x_col] - point).abs().groupby(curves["File Name"], sort=True).idxmin()
+        capacitance = curves.loc[nearest, "Capacitance (F)"].to_numpy()
+        in_sweep = ((x_min <= point) & (x_max >= point)).to_numpy()
+        features[f"Capacitance at {point:.10g} {unit} (F)"] = np.where(in_sweep, capacitance, np.nan)
+
+    # Extremes of impedance and phase angle
+    features["Min Impedance (O)"] = by_file["Impedance (O)"].min()
+    features["Max Impedance (O)"] = by_file["Impedance (O)"].max()
+    features["Min Phase Angle (D)"] = by_file["Phase Angle (D)"].min()
+    features["Max Phase Angle (D)"] = by_file["Phase Angle (D)"].max()
+
+    # Least squares slope of capacitance, against voltage for CV, and against
+    # decades of frequency for CF, from per-file sums. Sums are in float64, since
+    # the columns may be float32
+    x = curves[x_col].astype(float)
+    x = x if cf_or_cv == "CV" else np.log10(x)
+    y = curves["Capacitance (F)"].astype(float)
+    sums = pd.DataFrame({"x": x, "y": y, "xy": x * y, "xx": x * x}).groupby(curves["File Name"], sort=True).sum()
+    n = by_file.size()
+    slope_unit = "F/V" if cf_or_cv == "CV" else "F/decade"
+    features[f"Capacitance Slope ({slope_unit})"] = (n * sums["xy"] - sums["x"] * sums["y"]) / (n * sums["xx"] - sums["x"]**2)
+
+    # Hysteresis is the largest capacitance difference between measurements at
+    # the same sweep point, which only exists if the sweep went back over
+    # itself. One way sweeps are NaN
+    by_point = curves.groupby(["File Name", x_col], sort=True)["Capacitance (F)"]
+    spread = (by_point.max() - by_point.min()).where(by_point.size() > 1)
+    features["Hysteresis (F)"] = spread.groupby(level="File Name").max()
+
+    if file_names is not None:
+        features = features.reindex(pd.Index(file_names, name="File Name"))
+    return features
+
+# Compute and store the features of every CF and CV file, with the size and
+# modified time of each file, (see FILE_STAT_COLS). Rerun this after new
+# measurement files are added. If incremental, stored features are kept for
+# files whose size and modified time are the same as when they were stored, so
+# only new and changed files are computed. Like the measurement store, a file
+# counts as changed whenever these differ, even if it's older, such as when a
+# backup is restored
+def gen_curve_features(incremental=False):
+    os.makedirs(reads.STORE_DIR, exist_ok=True)
+    for cf_or_cv in ["CF", "CV"]:
+        features_path = get_features_path(cf_or_cv)
+        # Taken before reading, so a file written while features are computed
+        # is computed again on the next run
+        stats = get_curve_file_stats(cf_or_cv)
+        if not incremental or not os.path.isfile(features_path):
+            features = compute_curve_features(read_curves(cf_or_cv), cf_or_cv, stats.index)
+            features.join(stats).to_csv(features_path)
+            print(f"Stored features of {len(features)} {cf_or_cv} files")
+            continue
+
+        # Files whose size or modified time differ from when their features
+        # were stored. Tables from before these were stored are all changed
+        stored = pd.read_csv(features_path, index_col="File Name", float_precision="round_trip")
+        stored_stats = stored.reindex(index=stats.index, columns=FILE_STAT_COLS)
+        changed = stats.index[~(stored_stats == stats).all(axis=1)]
+
+        # Keep the unchanged files' features, and compute the rest
+        features = stored[stored.index.isin(stats.index) & ~stored.index.isin(changed)]
+        if len(changed) > 0:
+            computed = compute_curve_features(read_curves(cf_or_cv, set(changed)), cf_or_cv, changed)
+            features = pd.concat([features, computed.join(stats)]).sort_index()
+        features.to_csv(features_path)
+        print(f"Stored features of {len(features)} {cf_or_cv} files, {len(changed)} computed")
+
+# Get the stored features of each CF or CV file, computing them if they haven't
+# been stored. Files that couldn't be read have NaN features
+def get_curve_features(cf_or_cv: typing.Literal["CF", "CV"]):
+    features_path = get_features_path(cf_or_cv)
+    if not os.path.isfile(features_path):
+        return compute_curve_features(read_curves(cf_or_cv), cf_or_cv, get_curve_file_stats(cf_or_cv).index)
+    features = pd.read_csv(features_path, index_col="File Name", float_precision="round_trip")
+    return features.drop(columns=FILE_STAT_COLS, errors="ignore")
+
+# Check that a file that can't be read gets a row of NaN features, rather than
+# failing. A made up CF directory with one readable and one empty file is made
+# in a temporary directory, which is worked in until the check is done. Raises
+# an AssertionError if the features are wrong
+def check_unreadable_curves():
+    readable, empty = "03_01_0001_U1_20240411_CF_0.csv", "03_01_0001_U2_20240411_CF_0.csv"
+    cwd = os.getcwd()
+    quarantined = len(reads.quarantine)
+    with tempfile.TemporaryDirectory() as dir:
+        os.chdir(dir)
+        try:
+            for age in ["PRISTINE", "EXPOSED"]:
+                os.makedirs(f"CF/CF_{age}")
+            pd.DataFrame({
+                "Frequency (Hz)": [1e3, 1e4], "Capacitance (F)": [1.0, 2.0], "Impedance (O)": [3.0, 4.0], "Phase Angle (D)": [5.0, 6.0]
+            }).to_csv(f"CF/CF_PRISTINE/{readable}", index=False)
+            open(f"CF/CF_PRISTINE/{empty}", "w").close()
+
+            reads._file_index = None
+            features = get_curve_features("CF")
+        finally:
+            os.chdir(cwd)
+            reads._file_index = None
+            del reads.quarantine[quarantined:]
+
+    assert features.index.tolist() == [readable, empty], f"Expected features of {[readable, empty]}, found {features.index.tolist()}"
+    assert features.loc[readable, "Capacitance at 1000 Hz (F)"] == 1.0, "Features of the readable file are wrong"
+    assert features.loc[empty].isna().all(), "Features of the empty file aren't NaN"
+
+# Get master with the CF and CV features of each sensor added as columns. Each
+# feature has a column per age, such as "CV Min Impedance (O)_PRISTINE", and a
+# "_DELTA" column of the EXPOSED value minus the PRISTINE value. master_cols
+# limits which master columns are kept
+def get_master_curve_features(master_cols=None):
+    master = adds.get_master()
+
+    # Keep the file name columns until the features are joined
+    file_cols = ["CF_Baseline", "CF_Post", "CV_Baseline", "CV_Post"]
+    if master_cols is not None:
+        master = master[list(dict.fromkeys([*master_cols, *file_cols]))]
+
+    for cf_or_cv in ["CF", "CV"]:
+        features = get_curve_features(cf_or_cv)
+
+        # Join each age's features on its file name column
+        for age in ["PRISTINE", "EXPOSED"]:
+            baseline_or_post = "Baseline" if age == "PRISTINE" else "Post"
+            age_features = features.rename(columns=lambda feature: f"{cf_or_cv} {feature}_{age}")
+            master = master.merge(
+                age_features,
+                left_on=f"{cf_or_cv}_{baseline_or_post}", right_index=True,
+                how="left"
+            ).set_index(master.index)
+
+        # Change from pristine to exposed
+        for feature in features.columns:
+            master[f"{cf_or_cv} {feature}_DELTA"] = master[f"{cf_or_cv} {feature}_EXPOSED"] - master[f"{cf_or_cv} {feature}_PRISTINE"]
+
+    # The file names are no longer needed
+    if master_cols is not None:
+        master = master.drop(columns=[col for col in file_cols if col not in master_cols])
+
+    return master
+
+# Run Area ---------------------------------------------------------------------
+# Uncomment lines to run the generators
+
+if __name__ == "__main__":
+    # check_unreadable_curves()
+    gen_curve_features(incremental=True)
@@ -3,12 +3,289 @@
 # data is added.
 
 import reads
+import instrument
+import parallel
+import lod
 import cv2
 import os
 import typing
+import numpy as np
+import pandas as pd
 
-# Generate the cropped sensor images and store them
-def gen_sensor_images():
+# Record of every generated sensor image, with the board image it was cropped
+# from and the crop coords used. The incremental mode of gen_sensor_images uses
+# it to skip sensor images that are already up to date
+SENSOR_MANIFEST = "Imgscans_sensors_manifest.csv"
+
+# Cache of the transform that aligns each board image with its reference, used
+# by get_board_transforms
+BOARD_TRANSFORMS = "Imgscans_board_transforms.csv"
+
+# Response of an alignment, (see align_board_image), below which its shift isn't
+# trusted and crops aren't shifted. Boards aligned with a shifted copy of
+# themselves are near 1, boards of another pattern are about 0.6, and images
+# unlike the reference, such as noise or a blank scan, are near 0
+MIN_ALIGN_RESPONSE = 0.5
+
+# Read the sensor image manifest as a dict of output path -> manifest entry
+def read_sensor_manifest():
+    if not os.path.isfile(SENSOR_MANIFEST):
+        return {}
+    # Round trip precision, so coords compare equal to the ones they were made from
+    manifest = pd.read_csv(SENSOR_MANIFEST, float_precision="round_trip")
+    # Manifests from before reduced decoding only have full size crops
+    if "Reduce" not in manifest.columns:
+        manifest["Reduce"] = 1
+    return {entry["Output"]: entry for entry in manifest.to_dict("records")}
+
+# Write the sensor image manifest, given a dict of output path -> manifest entry
+def write_sensor_manifest(manifest: dict):
+    columns = ["Output", "Source", "Size", "Mtime", "Hash", "x1", "x2", "y1", "y2", "Reduce"]
+    pd.DataFrame(list(manifest.values()), columns=columns).to_csv(SENSOR_MANIFEST, index=False)
+
+# Check if a sensor image in the manifest is still up to date, meaning it exists
+# and was cropped from the same board image with the same coords and reduce
+def sensor_image_is_current(entry, source_path: str, coords: dict, reduce=1):
+    if entry is None or not os.path.isfile(entry["Output"]):
+        return False
+    if entry["Source"] != source_path or any(entry[key] != coords[key] for key in coords) or entry["Reduce"] != reduce:
+        return False
+
+    # An unchanged size and modified time means an unchanged file
+    stat = os.stat(source_path)
+    if entry["Size"] == stat.st_size and entry["Mtime"] == stat.st_mtime_ns:
+        return True
+
+    # Otherwise compare the contents, since the file may have only been touched
+    if entry["Hash"] != reads.file_hash(source_path):
+        return False
+    entry["Size"], entry["Mtime"] = stat.st_size, stat.st_mtime_ns
+    return True
+
+# Crop sensors out of a board image and write them. crops is a list of
+# (output path, coords) for each sensor, so the board image is only read once no
+# matter how many sensors are cropped from it. Returns the manifest entries of
+# the written images. With reduce, the board image is decoded at a fraction of
+# its size, (see reads.IMREAD_FLAGS), so the crops are that much smaller. OpenCV
+# can't decode only part of an image, so each crop is a view into the one
+# decode rather than a copy. This is at the top level, rather than in
+# gen_sensor_images, so that worker processes can run it
+@instrument.stage("generators.crop_board_image")
+def crop_board_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"], crops: list, reduce=1):
+    # Read board image
+    board_img = reads.get_board_image(file_name, age, reduce)
+
+    # Get width and height, to be used for calculating crop coords
+    height, width, _ = board_img.shape
+
+    # Record what the images were made from
+    source_path = f"Imgscans_{age}_edited/{file_name}"
+    stat = os.stat(source_path)
+    source = {"Source": source_path, "Size": stat.st_size, "Mtime": stat.st_mtime_ns, "Hash": reads.file_hash(source_path)}
+
+    entries = []
+    for output_path, coords in crops:
+        # Calculate crop coords based on crop percentages
+        x1 = round(coords["x1"] * width)
+        x2 = round(coords["x2"] * width)
+        y1 = round(coords["y1"] * height)
+        y2 = round(coords["y2"] * height)
+
+        # Get the cropped sensor
+        sensor_image = board_img[y1:y2, x1:x2]
+
+        # Write to file
+        cv2.imwrite(output_path, sensor_image)
+
+        entries.append({"Output": output_path, **source, **coords, "Reduce": reduce})
+
+    return entries
+
+# Get the board image file name for each board ID, for both ages. Each
+# directory is listed once. Sample use: board_index["EXPOSED"][board_id]
+def get_board_index():
+    board_index = {}
+    for age in ["PRISTINE", "EXPOSED"]:
+        board_index[age] = {}
+        for file_name in os.listdir(f"Imgscans_{age}_edited"):
+            board_id = "_".join(file_name.split("_")[:3])
+            # Take the first found file and use it
+            # TODO Handle cases of boards having multiple scans, possibly by
+            # using the iteration value
+            board_index[age].setdefault(board_id, file_name)
+    return board_index
+
+# Get the reference board image of each pattern, which other board images are
+# aligned to, as a dict of pattern -> pristine board image file name. Pristine
+# scans are the same for every board of a pattern, so they're used as references
+def get_reference_boards(board_index: dict):
+    references = {}
+    for board_id, file_name in sorted(board_index["PRISTINE"].items()):
+        references.setdefault(int(board_id.split("_")[1]), file_name)
+    return references
+
+# Find the shift of a board image from its reference image, on downsampled
+# grayscale copies. reduce is the downsampling, (see
+# reads.IMREAD_GRAYSCALE_FLAGS). Phase correlation finds the shift roughly, and
+# ECC, (enhanced correlation coefficient), refines it to a fraction of a pixel.
+# Returns a transform entry, with dx and dy, the full size pixel shift of the
+# board's contents from the reference's, and Response, the correlation of the
+# aligned images from 0 to 1, where a low value means an unreliable shift.
+# Returns None if either image couldn't be read. This is at the top level so
+# that worker processes can run it
+@instrument.stage("generators.align_board_image")
+def align_board_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"], reference_file_name: str, reduce=8):
+    board = reads.get_board_image(file_name, age, reduce, grayscale=True)
+    reference = reads.get_board_image(reference_file_name, "PRISTINE", reduce, grayscale=True)
+    if board is None or reference is None:
+        return None
+
+    # Both need the same size, so both are cut to the smaller of the two, from
+    # the top left where their coords line up
+    height = min(board.shape[0], reference.shape[0])
+    width = min(board.shape[1], reference.shape[1])
+    board = board[:height, :width].astype(np.float32)
+    reference = reference[:height, :width].astype(np.float32)
+
+    # Rough shift
+    window = cv2.createHanningWindow((width, height), cv2.CV_32F)
+    (dx, dy), response = cv2.phaseCorrelate(reference, board, window)
+
+    # Refined shift, keeping the rough one if ECC doesn't converge
+    warp = np.array([[1, 0, dx], [0, 1, dy]], dtype=np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 50, 1e-4)
+    try:
+        response, warp = cv2.findTransformECC(reference, board, warp, cv2.MOTION_TRANSLATION, criteria, None, 5)
+        dx, dy = warp[0, 2], warp[1, 2]
+    except cv2.error:
+        pass
+
+    # Size of the full size images, which crop coords are fractions of
+    full_board = reads.get_board_image_size(file_name, age)
+    full_reference = reads.get_board_image_size(reference_file_name, "PRISTINE")
+    return {
+        "dx": float(dx) * reduce, "dy": float(dy) * reduce, "Response": float(response),
+        "Width": full_board[0], "Height": full_board[1],
+        "Reference Width": full_reference[0], "Reference Height": full_reference[1]
+    }
+
+# Get the transform that aligns each board image with the reference of its
+# pattern, from get_reference_boards, as a dict of (file name, age) -> transform
+# entry, (see align_board_image). References are their own reference, so they
+# aren't shifted. Transforms are cached by the contents of both images, like
+# adds.get_image_stats, so a board is only aligned again when the board or
+# reference image changes, or reduce changes. Uncached boards are aligned
+# together, with workers and chunk_size passed to parallel.run_tasks. Boards
+# whose Response is below MIN_ALIGN_RESPONSE are reported, and align_coords
+# doesn't shift their crops
+@instrument.stage("generators.get_board_transforms")
+def get_board_transforms(board_index: dict, workers=1, chunk_size=2, reduce=8):
+    references = get_reference_boards(board_index)
+
+    # Caches from before hashes were recorded can't be looked up by contents,
+    # so they aren't used
+    cache = {}
+    if os.path.isfile(BOARD_TRANSFORMS):
+        cached = pd.read_csv(BOARD_TRANSFORMS, float_precision="round_trip")
+        if "Hash" in cached.columns:
+            cache = {entry["Source"]: entry for entry in cached.to_dict("records")}
+    hash_to_entry = {(entry["Hash"], entry["Reference Hash"], entry["Reduce"]): entry for entry in cache.values()}
+
+    transforms = {}
+    uncached = [] # Boards that need to be aligned
+    changed = False # Whether the cache needs to be written
+    reference_hashes = {} # Reference path -> hash, since many boards share one
+    for age in ["PRISTINE", "EXPOSED"]:
+        for board_id, file_name in board_index[age].items():
+            reference_file_name = references.get(int(board_id.split("_")[1]))
+            if reference_file_name is None:
+                continue
+            source_path = f"Imgscans_{age}_edited/{file_name}"
+            reference_path = f"Imgscans_PRISTINE_edited/{reference_file_name}"
+
+            # An unchanged size and modified time of both images means unchanged
+            # images
+            source_stat, reference_stat = os.stat(source_path), os.stat(reference_path)
+            entry = cache.get(source_path)
+            if (
+                entry is not None and entry["Reference"] == reference_path and entry["Reduce"] == reduce and
+                (entry["Size"], entry["Mtime"]) == (source_stat.st_size, source_stat.st_mtime_ns) and
+                (entry["Reference Size"], entry["Reference Mtime"]) == (reference_stat.st_size, reference_stat.st_mtime_ns)
+            ):
+                transforms[(file_name, age)] = entry
+                continue
+
+            # Otherwise look the pair up by their contents
+            if reference_path not in reference_hashes:
+                reference_hashes[reference_path] = reads.file_hash(reference_path)
+            source = {
+                "Source": source_path, "Reference": reference_path, "Reduce": reduce,
+                "Size": source_stat.st_size, "Mtime": source_stat.st_mtime_ns, "Hash": reads.file_hash(source_path),
+                "Reference Size": reference_stat.st_size, "Reference Mtime": reference_stat.st_mtime_ns, "Reference Hash": reference_hashes[reference_path]
+            }
+            entry = hash_to_entry.get((source["Hash"], source["Reference Hash"], reduce))
+            if entry is not None:
+                transforms[(file_name, age)] = {**entry, **source}
+                changed = True
+                continue
+
+            uncached.append((file_name, age, reference_file_name, source))
+
+    # A reference isn't shifted from itself, so it isn't aligned
+    tasks = []
+    for file_name, age, reference_file_name, entry in uncached:
+        if entry["Source"] == entry["Reference"]:
+            width, height = reads.get_board_image_size(file_name, age)
+            transforms[(file_name, age)] = {**entry, "dx": 0.0, "dy": 0.0, "Response": 1.0, "Width": width, "Height": height, "Reference Width": width, "Reference Height": height}
+        else:
+            tasks.append((file_name, age, reference_file_name, entry))
+
+    # Align all uncached boards in one batch
+    print(f"Board images to align: {len(tasks)}")
+    aligned = parallel.run_tasks(align_board_image, [(file_name, age, reference_file_name, reduce) for file_name, age, reference_file_name, _ in tasks], workers, chunk_size)
+    for (file_name, age, _, entry), transform in zip(tasks, aligned):
+        if transform is not None:
+            transforms[(file_name, age)] = {**entry, **transform}
+
+    # Save, keeping cached boards that weren't asked for
+    for entry in transforms.values():
+        cache[entry["Source"]] = entry
+    if changed or len(uncached) > 0:
+        pd.DataFrame(list(cache.values())).to_csv(BOARD_TRANSFORMS, index=False)
+
+    # Report alignments that won't be used
+    unreliable = [entry["Source"] for entry in transforms.values() if entry["Response"] < MIN_ALIGN_RESPONSE]
+    if len(unreliable) > 0:
+        print(f"Alignments too unreliable to use, so crops aren't shifted: {unreliable}")
+
+    return transforms
+
+# Get crop coords that are fractions of a reference image as fractions of a board
+# image that's shifted from it by a transform from get_board_transforms, so the
+# crop covers the same part of the sensor in both. Aligned coords are clamped to
+# the board image. Coords are returned as they are without a transform, or with
+# one whose Response is below MIN_ALIGN_RESPONSE
+def align_coords(coords: dict, transform):
+    if transform is None or transform["Response"] < MIN_ALIGN_RESPONSE:
+        return coords
+    aligned = {
+        "x1": (coords["x1"] * transform["Reference Width"] + transform["dx"]) / transform["Width"],
+        "x2": (coords["x2"] * transform["Reference Width"] + transform["dx"]) / transform["Width"],
+        "y1": (coords["y1"] * transform["Reference Height"] + transform["dy"]) / transform["Height"],
+        "y2": (coords["y2"] * transform["Reference Height"] + transform["dy"]) / transform["Height"]
+    }
+    return {key: min(max(value, 0.0), 1.0) for key, value in aligned.items()}
+
+# Generate the cropped sensor images and store them. In incremental mode, only
+# sensor images whose board image or crop coords changed are regenerated, and
+# sensor images whose board image is gone are deleted. workers and chunk_size
+# are passed to parallel.run_tasks, with workers=1 cropping serially. reduce is
+# passed to crop_board_image, for smaller sensor images that are faster to make.
+# With align, each board image is aligned with the reference of its pattern
+# before cropping, so scan shifts don't move the crops, (see
+# get_board_transforms)
+@instrument.stage("generators.gen_sensor_images")
+def gen_sensor_images(incremental=False, workers=1, chunk_size=2, reduce=1, align=False):
     # Stores the coords as percentages of the sensor bounds
     # Sample use: pattern_to_sensor_to_coords[pattern][sensor]["x1"|"y2"...]
     pattern_to_sensor_to_coords = {
@@ -38,42 +315,42 @@ def gen_sensor_images():
         }
     }
 
-    # Helper function used to generate a singular sensor image and write to file,
-    # given a master row and age
-    def gen_sensor_image(master_row, age: typing.Literal["EXPOSED", "PRISTINE"]):
-        # Get list of file names that start with this board ID
-        matching_file_names = [file for file in os.listdir(f"Imgscans_{age}_edited") if file.startswith(master_row["Board ID"])]
-        # If no files are found, return
-        if len(matching_file_names) == 0:
-            return
-        
-        # Take the first found file and use it
-        # TODO Handle cases of boards having multiple scans, possibly by using the
-        # iteration value
-        file_name = matching_file_names[0]
+    # Output path -> manifest entry, for every generated sensor image
+    manifest = read_sensor_manifest()
+    # Output paths of the sensor images that are still in use after this run
+    current_outputs = set()
+    # Board image (file name, age) -> list of (output path, coords) of the
+    # sensor images to crop out of it
+    board_to_crops = {}
 
-        # Read board image
-        board_img = reads.get_board_image(file_name, age)
+    board_index = get_board_index()
 
-        # Get width and height, to be used for calculating crop coords
-        height, width, _ = board_img.shape
-        # Calculate crop coords based on crop percentages
-        coords = pattern_to_sensor_to_coords[master_row["Pattern"]][master_row["Sensor"]]
-        x1 = round(coords["x1"] * width)
-        x2 = round(coords["x2"] * width)
-        y1 = round(coords["y1"] * height)
-        y2 = round(coords["y2"] * height)
+    # Board image (file name, age) -> transform, for aligned crops
+    transforms = get_board_transforms(board_index, workers, chunk_size) if align else {}
 
-        # Get the cropped sensor
-        sensor_image = board_img[y1:y2, x1:x2]
-        
-        # Get values to construct file name, and store file
+    # Helper function used to plan a singular sensor image, given a master row
+    # and age. Adds it to its board's crops if the image needs to be generated
+    def plan_sensor_image(master_row, age: typing.Literal["EXPOSED", "PRISTINE"]):
+        # If no board image is found, return
+        file_name = board_index[age].get(master_row["Board ID"])
+        if file_name is None:
+            return
+
+        # Get values to construct file name
         # TODO Add date. Date isn't used yet because of dates missing in master
         #month, day, year = tuple(map(int, master_row["Date"].split("/")))
-        file_name = f"{master_row["Board ID"]}_{"000" if age == "PRISTINE" else "001"}_{master_row["Sensor"]}.jpg"
+        output_path = f"Imgscans_{age}_sensors/{master_row["Board ID"]}_{"000" if age == "PRISTINE" else "001"}_{master_row["Sensor"]}.jpg"
+        current_outputs.add(output_path)
 
-        # Write to file
-        cv2.imwrite(f"Imgscans_{age}_sensors/{file_name}", sensor_image)
+        # Crop percentages for this sensor
+        coords = pattern_to_sensor_to_coords[master_row["Pattern"]][master_row["Sensor"]]
+        coords = align_coords(coords, transforms.get((file_name, age)))
+
+        # Skip if the existing image was made from the same board and coords
+        if incremental and sensor_image_is_current(manifest.get(output_path), f"Imgscans_{age}_edited/{file_name}", coords, reduce):
+            return
+
+        board_to_crops.setdefault((file_name, age), []).append((output_path, coords))
 
     master = reads.get_master()
 
@@ -86,35 +363,178 @@ def gen_sensor_images():
     # Drop duplicate indices
     master = master[~master.index.duplicated(keep='first')]
 
-    # Counter variable for printed progress
-    generated = 0
-
-    for pristine_file_name in os.listdir("Imgscans_PRISTINE_edited"):
+    # For each pristine board, plan the images of its sensors that are in master
+    for board_id in board_index["PRISTINE"]:
         for sensor in ["U1", "U2", "U3", "U4"]:
-            batch, pattern, id, _ = pristine_file_name.split("_")
-            board_id = "_".join([batch, pattern, id])
+            if (board_id, sensor) in master.index:
+                plan_sensor_image(master.loc[(board_id, sensor)], "PRISTINE")
 
-            # Get master rows that match this file
-            rows = master[(master["Board ID"] == board_id) & (master["Sensor"] == sensor)]
-            # Skip if no master rows match
-            if len(rows) == 0:
-                continue
-            # Generate image using the first found row
-            gen_sensor_image(rows.iloc[0], "PRISTINE")
-            
-            # Show progress
-            generated += 1
-            print(f"Images generated: {generated}")
-
-    # For each row in master, generate the EXPOSED image if possible
+    # For each row in master, plan the EXPOSED image if possible
     for _, row in master.iterrows():
-        gen_sensor_image(row, "EXPOSED")
-        
+        plan_sensor_image(row, "EXPOSED")
+
+    # One task per board image, so each is only read once
+    tasks = [(file_name, age, crops, reduce) for (file_name, age), crops in board_to_crops.items()]
+    print(f"Board images to crop: {len(tasks)}")
+
+    # Generate the images, recording what each was made from
+    for cropped, entries in enumerate(parallel.run_tasks(crop_board_image, tasks, workers, chunk_size), start=1):
+        for entry in entries:
+            manifest[entry["Output"]] = entry
+
         # Show progress
-        generated += 1
-        print(f"Images generated: {generated}")
+        print(f"Board images cropped: {cropped}")
+
+    # Delete sensor images whose board image is gone
+    if incremental:
+        for output_path, entry in list(manifest.items()):
+            if output_path in current_outputs or os.path.isfile(entry["Source"]):
+                continue
+            if os.path.isfile(output_path):
+                os.remove(output_path)
+            del manifest[output_path]
+            print(f"Deleted {output_path}, its board image is gone")
+
+    write_sensor_manifest(manifest)
+
+# Compile all CF, CV, and CurrentTime csv files into the measurement store, so
+# the readers in reads.py don't have to parse thousands of csv files each time,
+# or convert their types.
+# Rerun this after new measurement files are added, because files missing from
+# the store are read from their csv. Each file's size and modified time are
+# stored too, so reads.get_from_store can tell when its csv changed. If
+# incremental, files already in the store whose csv hasn't changed are copied
+# over rather than parsed again, so only new and changed files are read
+@instrument.stage("generators.gen_measurement_store")
+def gen_measurement_store(incremental=False):
+    os.makedirs(reads.STORE_DIR, exist_ok=True)
+    # The report only covers this build
+    reads.quarantine.clear()
+
+    for kind, dirs in reads.STORE_KINDS.items():
+        data_path = f"{reads.STORE_DIR}/{kind}.npy"
+
+        # Rows of the current store, which files are copied from if unchanged
+        stored_data, stored_rows = None, {}
+        if incremental:
+            store = reads.load_store(kind)
+            if store is not None:
+                stored_data, stored_rows = store
+
+        # Unchanged files' rows are taken from the store, and the rest are read
+        # from their csv all at once
+        files = [] # List of (file name, stat, stored rows, or None if read from csv)
+        file_paths = [] # Paths of the files read from csv
+        for dir in dirs:
+            for file_name in sorted(os.listdir(dir)):
+                # The csv is checked before it's read, so one modified while
+                # the store is built counts as changed next time
+                file_path = f"{dir}/{file_name}"
+                stat = os.stat(file_path)
+                if file_name in stored_rows and reads.is_stored_current(stored_rows[file_name], file_path):
+                    start, stop = stored_rows[file_name][:2]
+                    files.append((file_name, stat, stored_data[start:stop]))
+                else:
+                    files.append((file_name, stat, None))
+                    file_paths.append(file_path)
+        dfs = iter(reads.read_measurement_csvs(file_paths, kind))
+
+        pieces = [] # List of every file's rows, as structured arrays
+        columns = reads.MEASUREMENT_COLUMNS[kind]
+        index = [] # Rows of the index, (file name, start, stop, size, mtime)
+        rows = 0 # Running total of rows, which gives each file's start
+        for file_name, stat, piece in files:
+            if piece is None:
+                # Skip files that don't exist or were quarantined
+                df = next(dfs)
+                if df is None:
+                    continue
+
+                # One structured array, where each column is a named field
+                piece = np.empty(len(df), dtype=[(col, "f8") for col in columns])
+                for col in columns:
+                    piece[col] = df[col].to_numpy(dtype="f8")
+
+            pieces.append(piece)
+            index.append((file_name, rows, rows + len(piece), stat.st_size, stat.st_mtime_ns))
+            rows += len(piece)
+
+        if len(pieces) == 0:
+            continue
+
+        # Each column is stored with its type in reads.MEASUREMENT_SCHEMA if no
+        # precision is lost, (see reads.downcast), so reads from the store need
+        # no conversion
+        cols = {
+            col: reads.downcast(pd.Series(np.concatenate([piece[col] for piece in pieces]).astype("f8")), reads.MEASUREMENT_SCHEMA[col]).to_numpy()
+            for col in columns
+        }
+        data = np.empty(rows, dtype=[(col, values.dtype) for col, values in cols.items()])
+        for col, values in cols.items():
+            data[col] = values
+
+        # The old store may still be memory mapped, so the new one is written
+        # beside it and moved over it
+        np.save(f"{data_path}.tmp.npy", data)
+        del pieces, cols, stored_data
+        reads._store.pop(kind, None)
+        os.replace(f"{data_path}.tmp.npy", data_path)
+        pd.DataFrame(index, columns=["File Name", "Start", "Stop", "Size", "Mtime"]).to_csv(f"{reads.STORE_DIR}/{kind}_index.csv", index=False)
+        print(f"Stored {len(index)} {kind} files, {rows} rows, {len(file_paths)} read from csv")
+
+    # Drop anything already loaded, so the new store is used
+    reads._store.clear()
+
+    # Report what couldn't be read. Files that were quarantined aren't in the
+    # store, so they're read again, and reported again, on the next build
+    report = reads.get_quarantine_report()
+    report.to_csv(reads.QUARANTINE_REPORT, index=False)
+    print(f"Quarantined {report["Line"].notna().sum()} lines and {report["Line"].isna().sum()} files, see {reads.QUARANTINE_REPORT}")
+
+# Downsample every CurrentTime file to each level of detail in lod.LOD_BUCKETS
+# and store them, so plots don't have to draw every sample, (see lod.py). Each
+# level has an index of where each file's rows are, with the size and modified
+# time of the csv they came from, so reads.get_current_time_lod can tell when a
+# file changed. Rerun this after CurrentTime files are added or changed, because
+# files missing from the stored levels, or changed since, are downsampled each
+# time they're read
+@instrument.stage("generators.gen_current_time_lod")
+def gen_current_time_lod():
+    os.makedirs(reads.STORE_DIR, exist_ok=True)
+
+    traces = [] # List of every file's DataFrame
+    file_to_stat = {} # File name -> stat of its csv, from before it's read
+    for file_name in sorted(os.listdir("CurrentTime")):
+        stat = os.stat(f"CurrentTime/{file_name}")
+        current_time = reads.get_current_time(file_name)
+        if current_time is None or len(current_time) == 0:
+            continue
+        current_time = current_time.sort_values("Time (ms)", kind="stable")
+        current_time.insert(0, "File Name", file_name)
+        traces.append(current_time)
+        file_to_stat[file_name] = stat
+    traces = pd.concat(traces, ignore_index=True)
+
+    # Every file is downsampled at once at each level
+    for buckets in lod.LOD_BUCKETS:
+        downsampled = lod.downsample_min_max(traces, buckets, by=traces["File Name"].to_numpy())
+        downsampled.to_csv(reads.get_current_time_lod_path(buckets), index=False)
+
+        # Rows of each file are together, in the order of file names
+        file_names, starts, counts = np.unique(downsampled["File Name"].to_numpy(dtype=str), return_index=True, return_counts=True)
+        pd.DataFrame({
+            "File Name": file_names, "Start": starts, "Stop": starts + counts,
+            "Size": [file_to_stat[file_name].st_size for file_name in file_names],
+            "Mtime": [file_to_stat[file_name].st_mtime_ns for file_name in file_names]
+        }).to_csv(reads.get_current_time_lod_index_path(buckets), index=False)
+        print(f"Stored {len(downsampled)} of {len(traces)} CurrentTime samples at {buckets} buckets")
 
 # Run Area ---------------------------------------------------------------------
-# Uncomment lines to run the generators
+# Uncomment lines to run the generators. They are only run when this file is
+# run directly, so that importing it, such as by worker processes, has no effect
 
-gen_sensor_images()
+if __name__ == "__main__":
+    gen_sensor_images(incremental=True)
+    # gen_sensor_images(incremental=True, align=True)
+    # gen_measurement_store(incremental=True)
+    # gen_current_time_lod()
@@ -0,0 +1,204 @@
+# Opt-in instrumentation of the pipeline's stages, to find where the time of a
+# slow script goes. Each stage records its wall time, the files it opened and
+# bytes they hold, the rows it produced, and optionally its peak memory. When
+# instrumentation is off, which is the default, a stage only costs one check of
+# a flag, so the hooks can stay in place.
+#
+# Sample use:
+#   instrument.start(memory=True)
+#   master = adds.get_master_cf_or_cv("CF")
+#   instrument.summarize()
+#   instrument.export("trace.json") # Open in chrome://tracing or Perfetto
+#
+# Or, without changing a script, set IDC_TRACE to the file to export to when it
+# exits, and IDC_TRACE_MEMORY=1 to record peak memory too:
+#   IDC_TRACE=trace.csv python Analysis/fail_time.py
+#
+# Stages that run in worker processes, (see parallel.py), aren't recorded, but
+# the stage that started them includes their time.
+
+import atexit
+import functools
+import json
+import os
+import time
+import tracemalloc
+import pandas as pd
+
+# Whether stages are recorded
+enabled = False
+# Whether the peak memory of stages is recorded, which slows them down
+trace_memory = False
+# Every recorded stage, in the order they finished
+records = []
+# Stages that are running, innermost last
+_stack = []
+# When recording started, which record start times are relative to
+_start_time = 0.0
+# Whether start began tracing memory, rather than finding it already traced by
+# the caller, so stop only ends tracing that start began
+_started_tracing = False
+
+# Start recording stages, forgetting earlier records. With memory, the peak
+# memory of each stage is recorded with tracemalloc, which is started if it
+# isn't already tracing
+def start(memory=False):
+    global enabled, trace_memory, _start_time, _started_tracing
+    records.clear()
+    _stack.clear()
+    enabled, trace_memory = True, memory
+    _start_time = time.perf_counter()
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+
+# Stop recording stages. The records are kept until the next start. Memory
+# tracing is only stopped if start began it
+def stop():
+    global enabled, _started_tracing
+    enabled = False
+    if _started_tracing and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _started_tracing = False
+
+# A stage, used as a context manager around code such as plotting, where no
+# function is wrapped. rows can be set inside the with block
+#   with instrument.Stage("Render") as stage:
+#       ...
+class Stage:
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = None
+        self.recording = False
+
+    def __enter__(self):
+        self.recording = enabled
+        if not self.recording:
+            return self
+
+        self.files = 0
+        self.bytes = 0
+        self.peak = 0
+        if trace_memory:
+            # The parent's peak so far is kept before the peak is reset
+            current, peak = tracemalloc.get_traced_memory()
+            if len(_stack) > 0:
+                _stack[-1].peak = max(_stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = current
+        _stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.recording:
+            return False
+
+        seconds = time.perf_counter() - self.start
+        _stack.pop()
+        peak_memory = None
+        if trace_memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            peak_memory = self.peak - self.start_memory
+            if len(_stack) > 0:
+                _stack[-1].peak = max(_stack[-1].peak, self.peak)
+
+        records.append({
+            "Stage": self.name,
+            "Parent": _stack[-1].name if len(_stack) > 0 else None,
+            "Depth": len(_stack),
+            "Start (s)": self.start - _start_time,
+            "Seconds": seconds,
+            "Files": self.files,
+            "Bytes Read": self.bytes,
+            "Rows": self.rows,
+            "Peak Memory (B)": peak_memory,
+            "Error": exc_info[0].__name__ if exc_info[0] is not None else None
+        })
+        return False
+
+# Get the number of rows in a stage's result, or None if it has no rows. A
+# tuple's rows are those of its DataFrames
+def count_rows(result):
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result)
+    if isinstance(result, tuple):
+        rows = [count_rows(item) for item in result]
+        rows = [row for row in rows if row is not None]
+        return sum(rows) if len(rows) > 0 else None
+    return None
+
+# Decorator that records each call of a function as a stage, with the rows of
+# the DataFrame it returns
+#   @instrument.stage("reads.get_master")
+#   def get_master(): ...
+def stage(name: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Stage(name) as running:
+                result = func(*args, **kwargs)
+                running.rows = count_rows(result)
+            return result
+        return wrapper
+    return decorator
+
+# Record that a file was opened, counting it and its size in every running stage
+def record_file(file_path: str):
+    if not enabled or len(_stack) == 0:
+        return
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        size = 0
+    for running in _stack:
+        running.files += 1
+        running.bytes += size
+
+# Get the records as a DataFrame
+def get_records():
+    columns = ["Stage", "Parent", "Depth", "Start (s)", "Seconds", "Files", "Bytes Read", "Rows", "Peak Memory (B)", "Error"]
+    return pd.DataFrame(records, columns=columns)
+
+# Print and return the totals of each stage, slowest first. Nested stages are
+# included in their parents' totals
+def summarize():
+    summary = get_records().groupby("Stage").agg(**{
+        "Calls": ("Seconds", "size"),
+        "Seconds": ("Seconds", "sum"),
+        "Files": ("Files", "sum"),
+        "Bytes Read": ("Bytes Read", "sum"),
+        "Rows": ("Rows", lambda rows: rows.sum(min_count=1)),
+        "Peak Memory (B)": ("Peak Memory (B)", "max")
+    }).sort_values("Seconds", ascending=False)
+    print(summary.to_string())
+    return summary
+
+# Export the records to a file. A .json file is written as a Chrome trace, which
+# chrome://tracing and Perfetto show as a timeline. Any other file is written as
+# a CSV log with one row per stage call
+def export(file_path: str):
+    if not file_path.endswith(".json"):
+        get_records().to_csv(file_path, index=False)
+        return
+
+    events = []
+    for record in records:
+        events.append({
+            "name": record["Stage"],
+            "ph": "X",
+            "ts": record["Start (s)"] * 1e6,
+            "dur": record["Seconds"] * 1e6,
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": {key: record[key] for key in ["Files", "Bytes Read", "Rows", "Peak Memory (B)", "Error"]}
+        })
+    with open(file_path, "w") as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+# Turn on recording from the environment, exporting when the script exits
+if os.environ.get("IDC_TRACE"):
+    start(memory=os.environ.get("IDC_TRACE_MEMORY") == "1")
+    atexit.register(export, os.environ["IDC_TRACE"])
@@ -0,0 +1,57 @@
+# Levels of detail for plotting long traces, such as CurrentTime files. A trace is
+# split into equal time buckets, and only the lowest and highest samples of each
+# bucket are kept, (min-max downsampling). With at least one bucket per pixel of
+# the plot, the drawn line looks the same as the full trace, since every spike
+# is kept, but the cost of drawing it depends on the plot's width instead of the
+# trace's length.
+#
+# generators.gen_current_time_lod stores each level, and
+# reads.get_current_time_lod reads them.
+
+import numpy as np
+import pandas as pd
+
+# Buckets per trace of each stored level of detail
+LOD_BUCKETS = [256, 512, 1024, 2048, 4096]
+
+# Get the level of detail to plot at, given the plot's width in pixels, which is
+# the fewest buckets that still has one per pixel. Returns None if no level is
+# detailed enough, meaning the full traces should be plotted
+def choose_buckets(width_pixels: float):
+    for buckets in LOD_BUCKETS:
+        if buckets >= width_pixels:
+            return buckets
+    return None
+
+# Downsample traces to the lowest and highest y sample of each of buckets equal x
+# ranges, also keeping each trace's first and last samples. traces is sorted by
+# x within each trace, and by is an array of which trace each row belongs to, or
+# None for one trace. All traces are downsampled at once. Traces with at most 2
+# samples per bucket are kept whole. Returns the kept rows of traces, in order
+def downsample_min_max(traces: pd.DataFrame, buckets: int, x_col="Time (ms)", y_col="Current (mA)", by=None):
+    n = len(traces)
+    if n == 0:
+        return traces
+    if by is None:
+        by = np.zeros(n, dtype=np.int64)
+    else:
+        by = pd.factorize(by)[0]
+    x = traces[x_col].to_numpy(dtype=float)
+    y = pd.Series(traces[y_col].to_numpy(dtype=float))
+
+    # Bucket of each sample, from where it falls in its trace's x range
+    x_min = pd.Series(x).groupby(by).transform("min").to_numpy()
+    x_max = pd.Series(x).groupby(by).transform("max").to_numpy()
+    span = np.where(x_max > x_min, x_max - x_min, 1)
+    bucket = np.clip(((x - x_min) / span * buckets).astype(np.int64), 0, buckets - 1)
+    group = by * buckets + bucket
+
+    # Lowest, highest, first, and last samples, and every sample of short traces
+    keep = np.zeros(n, dtype=bool)
+    keep[y.groupby(group).idxmin().to_numpy()] = True
+    keep[y.groupby(group).idxmax().to_numpy()] = True
+    keep[np.r_[True, by[1:] != by[:-1]]] = True
+    keep[np.r_[by[1:] != by[:-1], True]] = True
+    keep |= np.bincount(by)[by] <= 2 * buckets
+
+    return traces[keep]
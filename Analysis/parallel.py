@@ -0,0 +1,24 @@
+# Shared helper for spreading independent, image heavy work over a pool of
+# worker processes. Results always come back in the order of the tasks, so the
+# parallel and serial paths give identical results.
+
+import concurrent.futures
+import os
+
+# Run func on each task, which is a tuple of arguments, and yield the results in
+# order. workers is the number of processes, with None meaning one per CPU, and
+# 1 meaning run serially in this process. Tasks are sent to workers in batches
+# of chunk_size, so the overhead of sending each task is spread out
+def run_tasks(func, tasks: list, workers=1, chunk_size=8):
+    if workers is None:
+        workers = os.cpu_count()
+
+    # Serial path, no processes needed
+    if workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield func(*task)
+        return
+
+    # func must be defined at the top level of a module, so workers can find it
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(func, *zip(*tasks), chunksize=chunk_size)
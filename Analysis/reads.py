@@ -8,65 +8,618 @@ import numpy as np
 import cv2
 import typing
 import os
+import hashlib
+import io
+import csv
+import re
+import instrument
+import lod
 
-# Get the master data as a DataFrame with proper data types
+# The measurement store is a compiled copy of every CF, CV, and CurrentTime csv,
+# built by generators.gen_measurement_store. Each kind is one structured NumPy
+# array of all its rows, plus an index csv of where each file's rows start and
+# stop. Reading from it skips csv parsing entirely
+STORE_DIR = "MeasurementStore"
+# Directories compiled into each kind of the store
+STORE_KINDS = {
+    "CF": ["CF/CF_PRISTINE", "CF/CF_EXPOSED"],
+    "CV": ["CV/CV_PRISTINE", "CV/CV_EXPOSED"],
+    "CurrentTime": ["CurrentTime"]
+}
+# Set to False to always parse the csv files, ignoring the store
+use_store = True
+# Loaded store kinds, stored as kind -> (data file mtime, data array, file name
+# -> (start, stop))
+_store = {}
+# Loaded CurrentTime levels of detail, stored as buckets -> (file mtime, traces
+# DataFrame, file name -> (start, stop))
+_lod_store = {}
+
+# The file index lists every measurement file, with the parts of its name parsed
+# out. It's cached on disk, and rebuilt when any of its directories change
+FILE_INDEX = f"{STORE_DIR}/file_index.csv"
+# Modified times of the directories when the cached file index was built
+FILE_INDEX_MTIMES = f"{STORE_DIR}/file_index_mtimes.csv"
+# Directories listed in the file index
+FILE_INDEX_DIRS = ["CF/CF_PRISTINE", "CF/CF_EXPOSED", "CV/CV_PRISTINE", "CV/CV_EXPOSED", "CurrentTime"]
+# Loaded file index, stored as (directory mtimes, index, file name -> directory)
+_file_index = None
+
+# Dated masterlist exports, which are named with the date they were exported,
+# such as IDCSubmersionMasterlist_20250505.csv. get_master reads the latest one
+# unless it's given a date
+MASTERLIST_PATTERN = r"IDCSubmersionMasterlist_(\d{8})\.csv"
+
+# imread flags for each image reduce factor. A reduced image is scaled down by
+# the JPEG decoder as it decodes, which is much faster than decoding at full size
+# and then resizing. Sample use: IMREAD_FLAGS[4] decodes at a quarter size
+IMREAD_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+# imread flags of grayscale images for each image reduce factor
+IMREAD_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+}
+
+# Declared data types of the master columns. Text that repeats, which is most
+# of it once master is joined onto measurements, is stored as categoricals.
+# Numbers are stored as float32, and dates are parsed
+MASTER_SCHEMA = {
+    "Pattern": "float32",
+    "Board ID": "category",
+    "Sensor": "category",
+    "Status": "category",
+    "Time to Failure (ms)": "float32",
+    "Current": "category",
+    "Location": "category",
+    "Date": "%m/%d/%Y",
+    "Solution": "category",
+    "Voltage": "float32",
+    "Notes": "category",
+    "CV_Post": "category",
+    "CF_Post": "category",
+    "Tags": "float32",
+    "CV_Baseline": "category",
+    "CF_Baseline": "category",
+    "Ph": "float32"
+}
+# Declared data types of the CF, CV, and CurrentTime columns
+MEASUREMENT_SCHEMA = {
+    "Frequency (Hz)": "float32",
+    "Voltage (V)": "float32",
+    "Capacitance (F)": "float32",
+    "Impedance (O)": "float32",
+    "Phase Angle (D)": "float32",
+    "Current (mA)": "float32",
+    "Time (ms)": "int32"
+}
+# Declared columns of each kind of measurement file, in the order they're
+# returned. Every column is read as float64, like the measurement store. A
+# file's header is matched to these by name, in any order, and a file missing
+# any of its kind's columns is quarantined
+MEASUREMENT_COLUMNS = {
+    "CF": ["Frequency (Hz)", "Capacitance (F)", "Impedance (O)", "Phase Angle (D)"],
+    "CV": ["Voltage (V)", "Capacitance (F)", "Impedance (O)", "Phase Angle (D)"],
+    "CurrentTime": ["Current (mA)", "Time (ms)"]
+}
+# Lines and files of measurement csvs that couldn't be read, as dicts of File,
+# Line, Reason, and Text, (see get_quarantine_report). It keeps growing until
+# cleared with quarantine.clear()
+quarantine = []
+# Where generators.gen_measurement_store writes the quarantine report
+QUARANTINE_REPORT = f"{STORE_DIR}/quarantine.csv"
+# Set to False to keep the data types pandas reads by default
+compact_dtypes = True
+
+# Cast a numeric column to a smaller data type, as long as no precision is lost.
+# For an int type, all values must be whole numbers in range. For a float type,
+# all values must keep 6 significant digits. Otherwise the column is returned
+# as it is
+def downcast(col: pd.Series, dtype: str):
+    values = col.to_numpy(dtype=float)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        lossless = not np.isnan(values).any() and (values == np.round(values)).all() \
+            and (len(values) == 0 or (values.min() >= info.min and values.max() <= info.max))
+    else:
+        lossless = np.allclose(values.astype(dtype), values, rtol=5e-7, atol=0, equal_nan=True)
+
+    if not lossless:
+        return col
+    return col.astype(dtype)
+
+# Cast a DataFrame's columns to the data types declared in a schema, which maps
+# column names to "category", a date format, or a numeric type. Columns that
+# aren't in the DataFrame are skipped. Does nothing if compact_dtypes is False
+def apply_schema(df: pd.DataFrame, schema: dict):
+    if not compact_dtypes:
+        return df
+
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype == "category":
+            df[col] = df[col].astype("category")
+        elif "%" in dtype:
+            df[col] = pd.to_datetime(df[col], format=dtype, errors="coerce")
+        else:
+            df[col] = downcast(df[col], dtype)
+
+    return df
+
+# Get every dated masterlist in the repository root, as a dict of date, (as
+# YYYYMMDD), -> path, oldest first
+def get_masterlist_paths():
+    paths = {}
+    for file_name in os.listdir("."):
+        match = re.fullmatch(MASTERLIST_PATTERN, file_name)
+        if match is not None:
+            paths[match[1]] = file_name
+    return dict(sorted(paths.items()))
+
+# Get the path of the masterlist exported on date, (as YYYYMMDD), or of the
+# latest masterlist if date is None
+def get_masterlist_path(date=None):
+    paths = get_masterlist_paths()
+    if len(paths) == 0:
+        raise FileNotFoundError("No masterlist found, expected a file named like IDCSubmersionMasterlist_YYYYMMDD.csv")
+    if date is None:
+        return list(paths.values())[-1]
+    if date not in paths:
+        raise FileNotFoundError(f"No masterlist from {date}, the masterlists are from: {", ".join(paths)}")
+    return paths[date]
+
+# Get the master data as a DataFrame with proper data types, from the masterlist
+# exported on date, (as YYYYMMDD), or from the latest masterlist if date is None
 # Future idea: Replace all occurrences of file names in cells with their
 # DataFrame equivalent
-def get_master():
-    master = pd.read_csv("IDCSubmersionMasterlist_20250505.csv")
+@instrument.stage("reads.get_master")
+def get_master(date=None):
+    masterlist = get_masterlist_path(date)
+    instrument.record_file(masterlist)
+    master = pd.read_csv(masterlist)
 
     # Cast numeric columns to numbers
     numeric_cols = ["Voltage", "Pattern"]
     master[numeric_cols] = master[numeric_cols].apply(lambda col: pd.to_numeric(col, errors="coerce"))
     # Do not drop NaN rows, because these rows could be useful
 
-    return master
+    return apply_schema(master, MASTER_SCHEMA)
+
+# Get several dated masterlists as one DataFrame, with a "Masterlist Date"
+# column of the date each row's masterlist was exported. dates is a list of
+# dates as YYYYMMDD, or None for every masterlist
+def get_masters(dates=None):
+    if dates is None:
+        dates = list(get_masterlist_paths())
+    masters = [get_master(date).assign(**{"Masterlist Date": pd.to_datetime(date, format="%Y%m%d")}) for date in dates]
+    # Categories differ between masterlists, so they're cast again
+    return apply_schema(pd.concat(masters, ignore_index=True), MASTER_SCHEMA)
+
+# Get a value that changes when a file or directory changes. For a directory,
+# this covers files being added, removed, or modified, but not subdirectories
+def get_fingerprint(path: str):
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    if os.path.isdir(path):
+        mtimes = [entry.stat().st_mtime_ns for entry in os.scandir(path) if entry.is_file()]
+        return (os.stat(path).st_mtime_ns, len(mtimes), max(mtimes, default=0))
+    # Missing
+    return None
+
+# Get the modified time of each file index directory that exists
+def get_file_index_mtimes():
+    return {dir: os.stat(dir).st_mtime_ns for dir in FILE_INDEX_DIRS if os.path.isdir(dir)}
+
+# List every file index directory, and parse each file name following the
+# Board_Pattern_ID_Sensor_Date_Type_Iteration convention. CurrentTime files have
+# type I and no iteration. Letter case of the sensor and type is ignored. Files
+# that don't follow the convention are left out
+@instrument.stage("reads.build_file_index")
+def build_file_index():
+    file_names = []
+    dirs = []
+    for dir in get_file_index_mtimes():
+        dir_file_names = sorted(os.listdir(dir))
+        file_names += dir_file_names
+        dirs += [dir] * len(dir_file_names)
+    file_names = pd.Series(file_names, dtype=object)
+
+    # Parse all names at once
+    components = file_names.str.extract(
+        r"^([^_]+)_(\d+)_([^_]+)_([Uu]\d)_(\d{8})_(CF|CV|[Ii])(?:_(\d+))?\.csv$"
+    )
+    index = pd.DataFrame({
+        "File Name": file_names,
+        "Directory": dirs,
+        "Board ID": components[0] + "_" + components[1] + "_" + components[2],
+        "Pattern": pd.to_numeric(components[1]),
+        "Sensor": components[3].str.upper(),
+        "Date": components[4],
+        "Type": components[5].str.upper().replace("I", "Current"),
+        "Iteration": pd.to_numeric(components[6])
+    })
+    # Iteration 0 is the baseline measurement
+    index["Age"] = np.where(index["Iteration"] == 0, "PRISTINE", np.where(index["Iteration"] > 0, "EXPOSED", None))
+
+    return index[components[0].notna()].reset_index(drop=True)
+
+# Get the file index as a DataFrame with one row per measurement file. It's
+# only rebuilt when files are added, removed, or renamed in its directories
+def get_file_index():
+    global _file_index
+    mtimes = get_file_index_mtimes()
+
+    # Use the loaded index if nothing changed
+    if _file_index is not None and _file_index[0] == mtimes:
+        return _file_index[1]
+
+    # Otherwise use the cached index if nothing changed, or rebuild it
+    index = None
+    if os.path.isfile(FILE_INDEX) and os.path.isfile(FILE_INDEX_MTIMES):
+        cached_mtimes = pd.read_csv(FILE_INDEX_MTIMES)
+        if dict(zip(cached_mtimes["Directory"], cached_mtimes["Mtime"])) == mtimes:
+            instrument.record_file(FILE_INDEX)
+            index = pd.read_csv(FILE_INDEX, dtype={"Date": str})
+    if index is None:
+        index = build_file_index()
+        os.makedirs(STORE_DIR, exist_ok=True)
+        index.to_csv(FILE_INDEX, index=False)
+        pd.DataFrame(list(mtimes.items()), columns=["Directory", "Mtime"]).to_csv(FILE_INDEX_MTIMES, index=False)
+
+    _file_index = (mtimes, index, dict(zip(index["File Name"], index["Directory"])))
+    return index
+
+# Get the path of a measurement file from the file index, or None if it isn't
+# in the index
+def get_file_path(file_name: str):
+    get_file_index()
+    dir = _file_index[2].get(file_name)
+    if dir is None:
+        return None
+    return f"{dir}/{file_name}"
+
+# Get the kind of measurement file at a path, (a key of STORE_KINDS), from the
+# directory it's in. Returns None if it isn't in one of their directories
+def get_measurement_kind(file_path: str):
+    dir = os.path.dirname(os.path.normpath(file_path))
+    for kind, dirs in STORE_KINDS.items():
+        if any(dir == kind_dir or dir.endswith(f"/{kind_dir}") for kind_dir in dirs):
+            return kind
+    return None
+
+# Add a line of a measurement csv, or the whole file if line is None, to the
+# quarantine, with why it couldn't be read and the text of the line
+def quarantine_line(file_path: str, line, reason: str, text=""):
+    quarantine.append({"File": file_path, "Line": line, "Reason": reason, "Text": text})
+
+# Get the quarantine as a DataFrame with a row per line or file that couldn't be
+# read, and columns of File, Line, Reason, and Text. Files read more than once
+# are only listed once
+def get_quarantine_report():
+    report = pd.DataFrame(quarantine, columns=["File", "Line", "Reason", "Text"]).astype({"Line": "Int64"})
+    return report.drop_duplicates(ignore_index=True)
+
+# Get the columns of a measurement csv's header line. The header is parsed as
+# csv, so quoted names are read like pandas would
+def get_header_columns(header: bytes):
+    text = header.decode("utf-8", errors="replace").lstrip("\ufeff").rstrip("\r")
+    return [col.strip() for col in next(csv.reader([text]), [])]
+
+# Get why a line of a measurement csv can't be read as a row of the header's
+# columns, or None if it can. Only the fields of columns are checked to be
+# numbers, and the other columns are ignored
+def get_line_problem(line: str, header: list, columns: list):
+    if line.strip() == "":
+        return "Blank line"
+    fields = line.split(",")
+    if len(fields) != len(header):
+        return f"Expected {len(header)} fields, found {len(fields)}"
+    for col in columns:
+        field = fields[header.index(col)]
+        if field.strip() == "":
+            return f"{col} is missing"
+        try:
+            value = float(field)
+        except ValueError:
+            return f"{col} isn't a number"
+        if np.isnan(value):
+            return f"{col} is missing"
+    return None
+
+# Parse the lines of a measurement csv after its header one at a time, for files
+# the C parser couldn't read. Lines that can't be read are quarantined, and the
+# rest are returned as a DataFrame of columns, in that order
+def parse_measurement_lines(file_path: str, body: bytes, header: list, columns: list):
+    positions = [header.index(col) for col in columns]
+    rows = []
+    for line_number, line in enumerate(body.decode("utf-8", errors="replace").splitlines(), start=2):
+        problem = get_line_problem(line, header, columns)
+        if problem is not None:
+            quarantine_line(file_path, line_number, problem, line)
+            continue
+        fields = line.split(",")
+        rows.append([float(fields[position]) for position in positions])
+
+    return pd.DataFrame(rows, columns=columns, dtype="float64")
+
+# Parse the bodies of measurement csvs, the lines after their headers, given a
+# list of (file path, body) of files with the same header. The bodies are
+# joined and parsed in one call of the C parser, then split back into a
+# DataFrame per file, of columns in that order. Rows with missing values are
+# quarantined. If the bodies can't be parsed together, such as when a field
+# isn't a number, each file is parsed on its own, and a file that still can't
+# be parsed is read a line at a time
+def parse_measurement_bodies(files: list, header: list, columns: list):
+    counts = np.array([body.count(b"\n") for _, body in files])
+    stops = np.cumsum(counts)
+    starts = stops - counts
+
+    try:
+        parsed = pd.read_csv(
+            io.BytesIO(b"".join(body for _, body in files)),
+            names=header, header=None, usecols=columns, dtype="float64",
+            skip_blank_lines=False, engine="c"
+        )[columns]
+        # Each line is a row, so the counts must add up
+        readable = len(parsed) == stops[-1]
+    except ValueError:
+        readable = False
+
+    if not readable:
+        if len(files) > 1:
+            return [df for file in files for df in parse_measurement_bodies([file], header, columns)]
+        file_path, body = files[0]
+        return [parse_measurement_lines(file_path, body, header, columns)]
+
+    # Quarantine rows with missing values, which may also be blank lines or
+    # lines with too few fields
+    missing = parsed.isna().to_numpy().any(axis=1)
+    for row in np.flatnonzero(missing):
+        i = np.searchsorted(stops, row, side="right")
+        file_path, body = files[i]
+        line = body.split(b"\n")[row - starts[i]].decode("utf-8", errors="replace").rstrip("\r")
+        quarantine_line(file_path, row - starts[i] + 2, get_line_problem(line, header, columns) or "Missing value", line)
+
+    return [
+        parsed.iloc[start:stop][~missing[start:stop]].reset_index(drop=True)
+        for start, stop in zip(starts, stops)
+    ]
+
+# Read many CF, CV, or CurrentTime csvs at once, with the declared columns of
+# their kind, (see MEASUREMENT_COLUMNS). kind is found from each file's
+# directory, or header, if None. Columns are found by name, so files may have
+# them in another order, or have other columns, which are left out. Files of a
+# kind with the same header are parsed together, which is much faster than
+# parsing thousands of small files one by one. Rows and files
+# that can't be read are left out and added to the quarantine, (see
+# get_quarantine_report). Returns a list of DataFrames in the order of
+# file_paths, with None for files that don't exist or were quarantined
+@instrument.stage("reads.read_measurement_csvs")
+def read_measurement_csvs(file_paths: list, kind=None):
+    dfs = [None] * len(file_paths)
+    header_to_files = {} # (Kind, header columns) -> list of (position, file path, body)
+
+    for position, file_path in enumerate(file_paths):
+        try:
+            instrument.record_file(file_path)
+            with open(file_path, "rb") as file:
+                text = file.read()
+        except FileNotFoundError:
+            # Return None if not readable
+            continue
 
-# Get a CurrentTime file as a DataFrame with proper data types
-def get_current_time(file_name: str):
+        # The header must have every declared column of the file's kind
+        header, _, body = text.partition(b"\n")
+        header_cols = get_header_columns(header)
+        file_kind = kind or get_measurement_kind(file_path) \
+            or next((header_kind for header_kind, columns in MEASUREMENT_COLUMNS.items() if set(columns) <= set(header_cols)), None)
+        if text.strip() == b"":
+            quarantine_line(file_path, None, "Empty file")
+            continue
+        if file_kind is None:
+            quarantine_line(file_path, None, "Columns don't match any kind of files", ",".join(header_cols))
+            continue
+        missing = [col for col in MEASUREMENT_COLUMNS[file_kind] if col not in header_cols]
+        if len(missing) > 0:
+            quarantine_line(file_path, None, f"Missing columns of {file_kind} files: {", ".join(missing)}", ",".join(header_cols))
+            continue
+
+        # Every body ends its last line, so bodies can be joined
+        if len(body) > 0 and not body.endswith(b"\n"):
+            body += b"\n"
+        header_to_files.setdefault((file_kind, tuple(header_cols)), []).append((position, file_path, body))
+
+    for (file_kind, header_cols), files in header_to_files.items():
+        parsed = parse_measurement_bodies([(file_path, body) for _, file_path, body in files], list(header_cols), MEASUREMENT_COLUMNS[file_kind])
+        for (position, _, _), df in zip(files, parsed):
+            dfs[position] = df
+
+    return dfs
+
+# Read a CF, CV, or CurrentTime csv from its path, with proper data types, (see
+# read_measurement_csvs). Returns None if the file doesn't exist or was
+# quarantined
+@instrument.stage("reads.read_measurement_csv")
+def read_measurement_csv(file_path: str):
+    return read_measurement_csvs([file_path])[0]
+
+# Load one kind of the measurement store, returning None if it hasn't been built.
+# It's loaded again if it was rebuilt since it was last loaded
+def load_store(kind: typing.Literal["CF", "CV", "CurrentTime"]):
+    data_path = f"{STORE_DIR}/{kind}.npy"
+    index_path = f"{STORE_DIR}/{kind}_index.csv"
+    if not os.path.isfile(data_path) or not os.path.isfile(index_path):
+        return None
+
+    mtime = os.stat(data_path).st_mtime_ns
+    if kind not in _store or _store[kind][0] != mtime:
+        # Memory map the data so only the rows that are used get read
+        instrument.record_file(data_path)
+        instrument.record_file(index_path)
+        data = np.load(data_path, mmap_mode="r")
+        index = pd.read_csv(index_path)
+        # Stores built before sizes and modified times were recorded can't be
+        # checked against their csv, so their files count as changed
+        for col in ["Size", "Mtime"]:
+            if col not in index.columns:
+                index[col] = -1
+        file_to_rows = dict(zip(index["File Name"], zip(index["Start"], index["Stop"], index["Size"], index["Mtime"])))
+        _store[kind] = (mtime, data, file_to_rows)
+
+    return _store[kind][1:]
+
+# Check whether a file's stored rows are still those of its csv, given its
+# file_to_rows entry from load_store. An unchanged size and modified time means
+# an unchanged csv
+def is_stored_current(entry: tuple, file_path: str):
     try:
-        # Read the file
-        current_time = pd.read_csv(f"CurrentTime/{file_name}")
-    except FileNotFoundError:
-        # Return None if not readable
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+    return entry[2] == stat.st_size and entry[3] == stat.st_mtime_ns
+
+# Get a file's DataFrame out of the measurement store. Returns None if the store
+# isn't in use, doesn't have the file, or has rows of a csv that changed since the
+# store was built, so the caller can read the csv instead
+def get_from_store(kind: typing.Literal["CF", "CV", "CurrentTime"], file_name: str):
+    if not use_store:
         return None
 
-    # Cast all columns to numbers
-    current_time = current_time.apply(lambda col: pd.to_numeric(col, errors="coerce"))
-    # Drop non-number rows
-    current_time.dropna(inplace=True)
+    store = load_store(kind)
+    if store is None:
+        return None
+    data, file_to_rows = store
+
+    file_path = get_file_path(file_name)
+    if file_name not in file_to_rows or file_path is None or not is_stored_current(file_to_rows[file_name], file_path):
+        return None
+    start, stop = file_to_rows[file_name][:2]
+
+    # The structured array's field names become the column names. The slice is
+    # copied so the caller is free to modify the DataFrame. Columns are stored
+    # with the types of MEASUREMENT_SCHEMA, so they're only converted without
+    # compact_dtypes
+    df = pd.DataFrame(data[start:stop])
+    if not compact_dtypes:
+        df = df.astype("float64")
+    return df
+
+# Get a CurrentTime file as a DataFrame with proper data types. Without schema,
+# a file read from its csv is left as float64, for callers that put many files
+# together and apply MEASUREMENT_SCHEMA once, since applying it to each file is
+# slower than reading it
+@instrument.stage("reads.get_current_time")
+def get_current_time(file_name: str, schema=True):
+    # Return None if file name is invalid
+    if not isinstance(file_name, str):
+        return None
+
+    # Use the measurement store if the file is in it
+    current_time = get_from_store("CurrentTime", file_name)
+    if current_time is None:
+        # Return None if the file doesn't exist
+        file_path = get_file_path(file_name)
+        if file_path is None:
+            return None
+        current_time = read_measurement_csv(file_path)
+        if schema and current_time is not None:
+            current_time = apply_schema(current_time, MEASUREMENT_SCHEMA)
 
     return current_time
 
-# Get a CF/CV file, (PRISTINE/EXPOSED), as a DataFrame with proper data types
-def get_cf_or_cv(file_name: str):
-    # Get 7 string components of file name
-    components = file_name.split(".")[0].split("_")
-    # Return None if name is unconventional
-    if len(components) != 7:
+# Get the path of a stored level of detail of the CurrentTime files
+def get_current_time_lod_path(buckets: int):
+    return f"{STORE_DIR}/CurrentTime_lod_{buckets}.csv"
+
+# Get the path of the index of a stored level of detail, which has the rows of
+# each file, and the size and modified time of the csv they came from
+def get_current_time_lod_index_path(buckets: int):
+    return f"{STORE_DIR}/CurrentTime_lod_{buckets}_index.csv"
+
+# Load a stored level of detail of the CurrentTime files, returning None if it
+# hasn't been generated. Levels generated before they had an index can't be
+# checked against their csv files, so they aren't used either. It's loaded again
+# if it was generated again since it was last loaded. MEASUREMENT_SCHEMA is
+# applied to every trace at once as it's loaded
+def load_current_time_lod(buckets: int):
+    lod_path = get_current_time_lod_path(buckets)
+    index_path = get_current_time_lod_index_path(buckets)
+    if not os.path.isfile(lod_path) or not os.path.isfile(index_path):
         return None
 
-    # Get components needed for file path
-    iteration = int(components[6])
-    age = "PRISTINE" if iteration == 0 else "EXPOSED"
-    cf_or_cv = components[5]
+    mtime = (os.stat(lod_path).st_mtime_ns, os.stat(index_path).st_mtime_ns, compact_dtypes)
+    if buckets not in _lod_store or _lod_store[buckets][0] != mtime:
+        instrument.record_file(lod_path)
+        instrument.record_file(index_path)
+        traces = pd.read_csv(lod_path, float_precision="round_trip")
+        index = pd.read_csv(index_path)
+        file_to_rows = dict(zip(index["File Name"], zip(index["Start"], index["Stop"], index["Size"], index["Mtime"])))
+        _lod_store[buckets] = (mtime, apply_schema(traces.drop(columns="File Name"), MEASUREMENT_SCHEMA), file_to_rows)
+    return _lod_store[buckets]
 
-    try:
-        # Read the file
-        df = pd.read_csv(f"{cf_or_cv}/{cf_or_cv}_{age}/{file_name}")
-    except FileNotFoundError:
-        # Return None if not readable
+# Get a CurrentTime file downsampled to a level of detail, (see lod.py), with
+# buckets as one of lod.LOD_BUCKETS, or None for the full file. The stored level
+# from generators.gen_current_time_lod is used if the file is in it and its csv
+# hasn't changed since, otherwise the file is downsampled as it's read
+@instrument.stage("reads.get_current_time_lod")
+def get_current_time_lod(file_name: str, buckets: int):
+    # Return None if file name is invalid
+    if not isinstance(file_name, str):
+        return None
+    if buckets is None:
+        return get_current_time(file_name)
+
+    stored = load_current_time_lod(buckets)
+    file_path = get_file_path(file_name)
+    if stored is not None and file_name in stored[2] and file_path is not None and is_stored_current(stored[2][file_name], file_path):
+        start, stop = stored[2][file_name][:2]
+        return stored[1].iloc[start:stop].reset_index(drop=True)
+
+    current_time = get_current_time(file_name)
+    if current_time is None:
+        return None
+    return lod.downsample_min_max(current_time.sort_values("Time (ms)", kind="stable"), buckets).reset_index(drop=True)
+
+# Get a CF/CV file, (PRISTINE/EXPOSED), as a DataFrame with proper data types.
+# schema is as in get_current_time
+@instrument.stage("reads.get_cf_or_cv")
+def get_cf_or_cv(file_name: str, schema=True):
+    # Return None if file name is invalid
+    if not isinstance(file_name, str):
+        return None
+
+    # Return None if the file doesn't exist, or has an unconventional name
+    file_path = get_file_path(file_name)
+    if file_path is None:
+        return None
+
+    # The CF or CV directory the file is in, returning None for CurrentTime
+    cf_or_cv = file_path.split("/")[0]
+    if cf_or_cv not in ["CF", "CV"]:
         return None
 
-    # Cast all columns to numbers
-    df = df.apply(lambda col: pd.to_numeric(col, errors="coerce"))
-    # Drop non-number rows
-    df.dropna(inplace=True)
+    # Use the measurement store if the file is in it
+    df = get_from_store(cf_or_cv, file_name)
+    if df is None:
+        df = read_measurement_csv(file_path)
+        if schema and df is not None:
+            df = apply_schema(df, MEASUREMENT_SCHEMA)
 
     return df
 
-# Get a board image from the file name
-def get_board_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"]):
+# Get a board image from the file name. With reduce as 2, 4, or 8, the image is
+# decoded at that fraction of its size, (see IMREAD_FLAGS). With grayscale, it's
+# decoded as one channel
+@instrument.stage("reads.get_board_image")
+def get_board_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"], reduce=1, grayscale=False):
     file_path = f"Imgscans_{age}_edited/{file_name}"
     
     # Return None if file name is invalid
@@ -74,10 +627,37 @@ def get_board_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"]):
         return None
     
     # Read and return file
-    return cv2.imread(file_path)
+    instrument.record_file(file_path)
+    return cv2.imread(file_path, (IMREAD_GRAYSCALE_FLAGS if grayscale else IMREAD_FLAGS)[reduce])
+
+# Get the (width, height) of a board image from its JPEG header, without decoding
+# it. Returns None if the file doesn't exist or isn't a JPEG
+def get_board_image_size(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"]):
+    file_path = f"Imgscans_{age}_edited/{file_name}"
+    if file_name is np.nan or not os.path.isfile(file_path):
+        return None
+
+    with open(file_path, "rb") as file:
+        # Start of image marker
+        if file.read(2) != b"\xff\xd8":
+            return None
 
-# Get a sensor image from the file name
-def get_sensor_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"]):
+        # Skip segments until a start of frame segment, which holds the size.
+        # These are markers 0xC0 to 0xCF, except 0xC4, 0xC8, and 0xCC
+        while True:
+            marker = file.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            length = int.from_bytes(file.read(2), "big")
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in [0xC4, 0xC8, 0xCC]:
+                frame = file.read(5)
+                return int.from_bytes(frame[3:5], "big"), int.from_bytes(frame[1:3], "big")
+            file.seek(length - 2, os.SEEK_CUR)
+
+# Get a sensor image from the file name. With reduce as 2, 4, or 8, the image is
+# decoded at that fraction of its size, (see IMREAD_FLAGS)
+@instrument.stage("reads.get_sensor_image")
+def get_sensor_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"], reduce=1):
     file_path = f"Imgscans_{age}_sensors/{file_name}"
 
     # Return None if file name is invalid
@@ -85,4 +665,10 @@ def get_sensor_image(file_name: str, age: typing.Literal["EXPOSED", "PRISTINE"])
         return None
     
     # Read and return file
-    return cv2.imread(file_path)
+    instrument.record_file(file_path)
+    return cv2.imread(file_path, IMREAD_FLAGS[reduce])
+
+# Get the SHA-1 hash of a file's contents
+def file_hash(file_path: str):
+    with open(file_path, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
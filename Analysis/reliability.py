@@ -0,0 +1,330 @@
+# Reliability analysis of time to failure. Sensors that were stopped before
+# failing, such as "Measure/Scanned", are kept as censored, meaning they're only
+# known to survive at least their listed time, rather than being dropped or
+# counted as failures. For each Solution, Pattern, and Voltage group this fits:
+#   - Weibull and lognormal models, by maximum likelihood with censoring
+#   - Kaplan-Meier survival curves, which assume no model
+# along with bootstrap confidence intervals for every estimate.
+#
+# Every group and every bootstrap resample is fit at once, as rows of 2D arrays
+# where each group is a block of columns, so thousands of resamples take seconds.
+#
+# Sample use:
+#   fits = reliability.get_reliability()
+#   curves = reliability.kaplan_meier(reliability.get_survival_data())
+
+import adds
+import instrument
+import numpy as np
+import pandas as pd
+import warnings
+
+# Statuses of sensors that failed, and of sensors that were stopped or are still
+# running, which are censored at their listed time. Sensors with other
+# statuses, such as "Not started", aren't used
+FAILED_STATUSES = ["Failed"]
+CENSORED_STATUSES = ["Measure/Scanned", "In progress"]
+
+# Columns that define the groups that are fit
+GROUP_COLS = ["Solution", "Pattern", "Voltage"]
+
+# Groups with fewer failures than this aren't fit with models, since the fit
+# isn't defined or is meaningless
+MIN_FAILURES = 2
+
+# Bounds of the Weibull shape, outside of which a fit is treated as failed
+WEIBULL_SHAPE_BOUNDS = (0.02, 50.0)
+
+# Names of the estimates of estimate_groups, in the order of get_reliability's
+# columns
+ESTIMATES = ["Weibull Shape", "Weibull Scale (ms)", "Weibull Median (ms)", "Lognormal Mu", "Lognormal Sigma", "Lognormal Median (ms)", "KM Median (ms)"]
+
+# Get the sensors used in reliability analysis, with group_cols, "Time to
+# Failure (ms)", and "Failed", which is False for censored sensors. Sensors
+# without a time or group are left out. Rows are sorted by group, then time,
+# with failures before censored sensors at the same time, which the fits rely
+# on. master is used instead of get_master() if given
+@instrument.stage("reliability.get_survival_data")
+def get_survival_data(master=None, group_cols=GROUP_COLS):
+    if master is None:
+        master = adds.get_master()
+
+    data = master[master["Status"].isin(FAILED_STATUSES + CENSORED_STATUSES)]
+    data = data[["Board ID", "Sensor", *group_cols, "Time to Failure (ms)"]].assign(Failed=data["Status"].isin(FAILED_STATUSES))
+    data = data.dropna(subset=[*group_cols, "Time to Failure (ms)"])
+    data = data[data["Time to Failure (ms)"] > 0]
+
+    return data.sort_values([*group_cols, "Time to Failure (ms)", "Failed"], ascending=[True] * (len(group_cols) + 1) + [False])
+
+# Get the groups of survival data, sorted like get_survival_data, as a tuple of
+# (keys, starts, sizes). keys is a DataFrame of group_cols with a row per group,
+# and starts and sizes are each group's first row and number of rows
+def get_groups(data: pd.DataFrame, group_cols=GROUP_COLS):
+    sizes = data.groupby(group_cols, observed=True, sort=False).size()
+    keys = sizes.index.to_frame(index=False)
+    sizes = sizes.to_numpy()
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    return keys, starts, sizes
+
+# Sum each group's block of columns of x, an array of (rows, columns)
+def sum_groups(x: np.ndarray, starts: np.ndarray):
+    return np.add.reduceat(x, starts, axis=1)
+
+# Get the ratio of the standard normal density to its survival function,
+# φ(z) / (1 - Φ(z)), without overflow for large z. The survival function uses the
+# erfc approximation of Numerical Recipes, which has a relative error under
+# 1.2e-7
+def normal_hazard(z: np.ndarray):
+    x = np.abs(z) / np.sqrt(2)
+    t = 1 / (1 + 0.5 * x)
+    poly = -1.26551223 + t*(1.00002368 + t*(0.37409196 + t*(0.09678418 + t*(-0.18628806 + t*(0.27886807 + t*(-1.13520398 + t*(1.48851587 + t*(-0.82215223 + t*0.17087277))))))))
+    # For z >= 0 the exp(-z² / 2) of the density and survival function cancel
+    upper = 2 / (np.sqrt(2 * np.pi) * t * np.exp(poly))
+    lower = np.exp(-z**2 / 2) / np.sqrt(2 * np.pi) / (1 - 0.5 * t * np.exp(-x**2 + poly))
+    return np.where(z >= 0, upper, lower)
+
+# Fit a Weibull model to each group of each row, returning (shape, scale) arrays
+# of (rows, groups). The shape is found by bisection of the censored likelihood
+# equation, which only has one root, so every group of every row is solved at
+# once in a fixed number of steps. Groups with fewer than min_failures failures,
+# or whose shape isn't within WEIBULL_SHAPE_BOUNDS, are NaN
+def fit_weibull(time: np.ndarray, failed: np.ndarray, starts: np.ndarray, sizes: np.ndarray, min_failures=MIN_FAILURES, steps=60):
+    log_time = np.log(time)
+    failures = sum_groups(failed, starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_failed_log_time = sum_groups(failed * log_time, starts) / failures
+
+    # Sums of t^k and t^k ln(t) of each group, scaled by the group's largest t^k
+    # so they don't overflow
+    def power_sums(shape):
+        power = np.repeat(shape, sizes, axis=1) * log_time
+        largest = np.maximum.reduceat(power, starts, axis=1)
+        weights = np.exp(power - np.repeat(largest, sizes, axis=1))
+        return sum_groups(weights, starts), sum_groups(weights * log_time, starts), largest
+
+    low = np.full(failures.shape, np.log(WEIBULL_SHAPE_BOUNDS[0]))
+    high = np.full(failures.shape, np.log(WEIBULL_SHAPE_BOUNDS[1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _ in range(steps):
+            middle = (low + high) / 2
+            shape = np.exp(middle)
+            total, log_total, _ = power_sums(shape)
+            too_high = log_total / total - 1 / shape - mean_failed_log_time > 0
+            high = np.where(too_high, middle, high)
+            low = np.where(too_high, low, middle)
+
+        shape = np.exp((low + high) / 2)
+        total, _, largest = power_sums(shape)
+        scale = np.exp((np.log(total) + largest - np.log(failures)) / shape)
+
+    # A shape at the bounds means the root wasn't found
+    bad = (failures < min_failures) | (low <= np.log(WEIBULL_SHAPE_BOUNDS[0]) + 1e-6) | (high >= np.log(WEIBULL_SHAPE_BOUNDS[1]) - 1e-6)
+    return np.where(bad, np.nan, shape), np.where(bad, np.nan, scale)
+
+# Fit a lognormal model to each group of each row, returning (mu, sigma) arrays
+# of (rows, groups), the mean and standard deviation of ln(time). Fit with
+# Newton's method in terms of mu / sigma and 1 / sigma, where the censored
+# likelihood is concave, so it converges from any start, until no estimate moves
+# by more than tolerance. Groups with fewer than min_failures failures are NaN
+def fit_lognormal(time: np.ndarray, failed: np.ndarray, starts: np.ndarray, sizes: np.ndarray, min_failures=MIN_FAILURES, max_steps=100, tolerance=1e-9):
+    censored = 1 - failed
+    failures = sum_groups(failed, starts)
+
+    # Log times are centered on each group's mean, which keeps the steps well
+    # conditioned
+    log_time = np.log(time)
+    center = sum_groups(log_time, starts) / sizes
+    y = log_time - np.repeat(center, sizes, axis=1)
+
+    # Start from every time, as if none were censored
+    sigma = np.sqrt(sum_groups(y**2, starts) / sizes)
+    bad = (failures < min_failures) | (sigma == 0)
+    alpha = np.zeros(failures.shape)
+    tau = 1 / np.where(bad, 1, sigma)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for _ in range(max_steps):
+            z = np.repeat(tau, sizes, axis=1) * y - np.repeat(alpha, sizes, axis=1)
+            hazard = np.where(censored > 0, normal_hazard(z), 0)
+
+            # Gradient and Hessian of the log likelihood
+            curvature = failed + censored * hazard * (hazard - z)
+            gradient_alpha = sum_groups(failed * z + censored * hazard, starts)
+            gradient_tau = failures / tau - sum_groups((failed * z + censored * hazard) * y, starts)
+            hessian_alpha = -sum_groups(curvature, starts)
+            hessian_cross = sum_groups(curvature * y, starts)
+            hessian_tau = -failures / tau**2 - sum_groups(curvature * y**2, starts)
+
+            # Newton step, shortened if needed to keep 1 / sigma positive
+            determinant = hessian_alpha * hessian_tau - hessian_cross**2
+            step_alpha = -(hessian_tau * gradient_alpha - hessian_cross * gradient_tau) / determinant
+            step_tau = -(hessian_alpha * gradient_tau - hessian_cross * gradient_alpha) / determinant
+            shorten = np.where(tau + step_tau <= 0, -0.5 * tau / step_tau, 1)
+            step_alpha, step_tau = np.where(bad, 0, shorten * step_alpha), np.where(bad, 0, shorten * step_tau)
+            alpha, tau = alpha + step_alpha, tau + step_tau
+
+            if np.nanmax(np.abs(step_alpha / tau) + np.abs(step_tau / tau**2), initial=0) < tolerance:
+                break
+
+        mu = center + alpha / tau
+        sigma = 1 / tau
+
+    bad |= ~np.isfinite(mu) | ~np.isfinite(sigma)
+    return np.where(bad, np.nan, mu), np.where(bad, np.nan, sigma)
+
+# Get the Kaplan-Meier median of each group of each row, the first time its
+# survival falls to 0.5 or below, as an array of (rows, groups). NaN where it
+# never does. Each group's columns must be sorted by time, with failures before
+# censored sensors at the same time. Each row has the same group sizes, so each
+# column's number at risk is the same in every row
+def km_median(time: np.ndarray, failed: np.ndarray, starts: np.ndarray, sizes: np.ndarray):
+    ends = np.repeat(starts + sizes, sizes)
+    at_risk = ends - np.arange(len(ends))
+
+    # Failures at the same time each take a step, which multiply to the same
+    # survival as one step for all of them. A step to zero survival is kept
+    # finite, so the next group's offset can still be subtracted
+    with np.errstate(divide="ignore"):
+        log_step = np.maximum(np.log(1 - failed / at_risk), -1e6)
+    log_survival = np.cumsum(log_step, axis=1)
+    group_offset = np.repeat(np.c_[np.zeros((len(time), 1)), log_survival[:, starts[1:] - 1]], sizes, axis=1)
+    survival = np.exp(log_survival - group_offset)
+
+    # Survival of exactly 0.5 can come out just above it from the steps' rounding
+    median = np.minimum.reduceat(np.where(survival <= 0.5 + 1e-9, time, np.inf), starts, axis=1)
+    return np.where(np.isfinite(median), median, np.nan)
+
+# Get every estimate of ESTIMATES for each group of each row, as a dict of
+# estimate name -> array of (rows, groups)
+def estimate_groups(time: np.ndarray, failed: np.ndarray, starts: np.ndarray, sizes: np.ndarray, min_failures=MIN_FAILURES):
+    shape, scale = fit_weibull(time, failed, starts, sizes, min_failures)
+    mu, sigma = fit_lognormal(time, failed, starts, sizes, min_failures)
+    return {
+        "Weibull Shape": shape,
+        "Weibull Scale (ms)": scale,
+        "Weibull Median (ms)": scale * np.log(2)**(1 / shape),
+        "Lognormal Mu": mu,
+        "Lognormal Sigma": sigma,
+        "Lognormal Median (ms)": np.exp(mu),
+        "KM Median (ms)": km_median(time, failed, starts, sizes)
+    }
+
+# Draw resamples bootstrap resamples of each group, as arrays of (resamples,
+# rows) of time and failed. Each group is resampled with replacement from its
+# own rows, into its own block of columns, and each row is sorted so the
+# resamples keep the order of get_survival_data
+def bootstrap_resample(time: np.ndarray, failed: np.ndarray, starts: np.ndarray, sizes: np.ndarray, resamples: int, rng: np.random.Generator):
+    column_starts = np.repeat(starts, sizes)
+    column_sizes = np.repeat(sizes, sizes)
+    positions = column_starts + (rng.random((resamples, len(time))) * column_sizes).astype(np.int64)
+    # Rows are already sorted, so sorting positions sorts the resamples
+    positions.sort(axis=1)
+    return time[positions], failed[positions]
+
+# Fit every group of survival data from get_survival_data, returning a
+# DataFrame with a row per group of:
+#   - group_cols, "Sensors", "Failures", and "Censored"
+#   - each of ESTIMATES, with "<estimate> Lower" and "<estimate> Upper" bounds
+#     of its bootstrap confidence interval, from resamples bootstrap resamples
+# Models of groups with fewer than min_failures failures are NaN. seed makes the
+# intervals repeatable, and resamples of 0 skips them
+@instrument.stage("reliability.fit_groups")
+def fit_groups(data: pd.DataFrame, group_cols=GROUP_COLS, resamples=2000, confidence=0.95, min_failures=MIN_FAILURES, seed=None):
+    keys, starts, sizes = get_groups(data, group_cols)
+    time = data["Time to Failure (ms)"].to_numpy(dtype=float)
+    failed = data["Failed"].to_numpy(dtype=float)
+
+    fits = keys.copy()
+    fits["Sensors"] = sizes
+    fits["Failures"] = sum_groups(failed[None, :], starts)[0].astype(int)
+    fits["Censored"] = fits["Sensors"] - fits["Failures"]
+
+    estimates = estimate_groups(time[None, :], failed[None, :], starts, sizes, min_failures)
+    if resamples > 0:
+        resampled_time, resampled_failed = bootstrap_resample(time, failed, starts, sizes, resamples, np.random.default_rng(seed))
+        resampled = estimate_groups(resampled_time, resampled_failed, starts, sizes, min_failures)
+
+    for name in ESTIMATES:
+        fits[name] = estimates[name][0]
+        if resamples > 0:
+            # Resamples where the estimate isn't defined are left out
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                bounds = np.nanquantile(resampled[name], [(1 - confidence) / 2, (1 + confidence) / 2], axis=0)
+            fits[f"{name} Lower"] = np.where(np.isnan(fits[name]), np.nan, bounds[0])
+            fits[f"{name} Upper"] = np.where(np.isnan(fits[name]), np.nan, bounds[1])
+
+    return fits
+
+# Get the Kaplan-Meier survival curve of every group of survival data from
+# get_survival_data, as a DataFrame with a row per group and time of:
+#   - group_cols and "Time to Failure (ms)"
+#   - "At Risk": sensors still running just before the time
+#   - "Failures" and "Censored": sensors that failed or were censored at it
+#   - "Survival": fraction of sensors surviving past it
+#   - "Std Error": Greenwood's standard error of "Survival"
+@instrument.stage("reliability.kaplan_meier")
+def kaplan_meier(data: pd.DataFrame, group_cols=GROUP_COLS):
+    curves = data.groupby([*group_cols, "Time to Failure (ms)"], observed=True).agg(
+        Removed=("Failed", "size"),
+        Failures=("Failed", "sum")
+    ).reset_index()
+    curves["Censored"] = curves["Removed"] - curves["Failures"]
+
+    groups = curves.groupby(group_cols, observed=True, sort=False)
+    curves["At Risk"] = groups["Removed"].transform("sum") - groups["Removed"].cumsum() + curves["Removed"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        curves["Survival"] = (1 - curves["Failures"] / curves["At Risk"]).groupby([curves[col] for col in group_cols], observed=True).cumprod()
+        greenwood = (curves["Failures"] / (curves["At Risk"] * (curves["At Risk"] - curves["Failures"]))).groupby([curves[col] for col in group_cols], observed=True).cumsum()
+        curves["Std Error"] = curves["Survival"] * np.sqrt(greenwood.replace(np.inf, np.nan))
+
+    return curves[[*group_cols, "Time to Failure (ms)", "At Risk", "Failures", "Censored", "Survival", "Std Error"]]
+
+# Fit every group of master's sensors, as from fit_groups. master is used
+# instead of get_master() if given
+def get_reliability(master=None, group_cols=GROUP_COLS, resamples=2000, confidence=0.95, min_failures=MIN_FAILURES, seed=None):
+    return fit_groups(get_survival_data(master, group_cols), group_cols, resamples, confidence, min_failures, seed)
+
+# Plot one voltage's Kaplan-Meier curves from kaplan_meier, with a row of axes
+# per pattern and a line per solution, returning the figure. Censored sensors
+# are marked with a "+"
+def plot_survival(voltage_curves: pd.DataFrame, voltage):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    # Each curve starts at full survival, and steps down at each failure
+    def plot_steps(data, color, label):
+        ax = plt.gca()
+        time = np.r_[0, data["Time to Failure (ms)"].to_numpy() / 1000]
+        survival = np.r_[1, data["Survival"].to_numpy()]
+        ax.step(time, survival, where="post", color=color, label=label)
+        censored = data["Censored"].to_numpy() > 0
+        ax.plot(time[1:][censored], survival[1:][censored], "+", color=color)
+
+    # Only solutions run at this voltage take up space in the legend
+    voltage_curves = voltage_curves.copy()
+    if voltage_curves["Solution"].dtype == "category":
+        voltage_curves["Solution"] = voltage_curves["Solution"].cat.remove_unused_categories()
+
+    g = sns.FacetGrid(
+        data=voltage_curves,
+        row="Pattern", row_order=[1, 4, 7, 10],
+        hue="Solution",
+        margin_titles=True,
+        sharex=False,
+        aspect=3
+    )
+    g.map_dataframe(plot_steps)
+    g.set_titles(row_template="Pattern {row_name}")
+    g.set_axis_labels("Time (s)", "Survival")
+    g.add_legend(title="Solution", edgecolor="#000000", frameon=True)
+    g.figure.suptitle(f"Kaplan-Meier Survival, by Pattern and Solution ({int(voltage)}V)")
+    g.figure.subplots_adjust(top=0.94, bottom=0.05)
+
+    return g.figure
+
+# Run Area ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    fits = get_reliability(seed=0)
+    print(fits[[*GROUP_COLS, "Sensors", "Failures", "Weibull Shape", "Weibull Median (ms)", "Weibull Median (ms) Lower", "Weibull Median (ms) Upper", "KM Median (ms)"]].to_string())
@@ -0,0 +1,191 @@
+# Renders every figure of the plotting scripts to files, rather than showing
+# them one window at a time. The data views are built once with a session and
+# shared by the figures, and figures are drawn with the Agg backend, so no
+# display is needed and they can be drawn in worker processes. A script's
+# figures are only drawn again when the files their data is built from, or the
+# code that builds and plots it, changes since the last render. An unchanged
+# script is skipped before any of its data is built, so a rerun with nothing
+# changed is cheap.
+#
+# Sample use, from the repository root:
+#   python Analysis/render.py                   # Every figure
+#   python Analysis/render.py --workers 4       # In 4 worker processes
+#   python Analysis/render.py fail_time --force # Redraw only fail_time figures
+
+# The backend is set before any script imports pyplot
+import matplotlib
+matplotlib.use("Agg")
+
+import Ph_Plots
+import fail_time
+import current_time
+import dendrites
+import reliability
+import session
+import parallel
+import instrument
+import adds
+import reads
+import lod
+import argparse
+import hashlib
+import inspect
+import os
+import matplotlib.pyplot as plt
+import pandas as pd
+
+# Where figures are written
+FIGURE_DIR = "Figures"
+# Record of every rendered figure, with the hash of its inputs, used to skip
+# figures that are already up to date
+RENDER_MANIFEST = f"{FIGURE_DIR}/render_manifest.csv"
+
+# Script names, in the order their figures are rendered
+SCRIPTS = ["Ph_Plots", "fail_time", "current_time", "dendrites", "reliability"]
+
+# Script name -> module, whose code builds and plots its figures
+SCRIPT_MODULES = {
+    "Ph_Plots": Ph_Plots,
+    "fail_time": fail_time,
+    "current_time": current_time,
+    "dendrites": dendrites,
+    "reliability": reliability
+}
+# Modules every script's data is built with
+PIPELINE_MODULES = [reads, adds, lod]
+
+# Get the files and directories a script's data is built from. Every script
+# uses master, and current_time also reads the CurrentTime files, from the
+# measurement store and its levels of detail where possible
+def get_script_sources(script: str):
+    sources = session.get_master_sources()
+    if script == "current_time":
+        sources += [
+            f"{reads.STORE_DIR}/CurrentTime.npy", f"{reads.STORE_DIR}/CurrentTime_index.csv",
+            *[reads.get_current_time_lod_path(buckets) for buckets in lod.LOD_BUCKETS],
+            *[reads.get_current_time_lod_index_path(buckets) for buckets in lod.LOD_BUCKETS]
+        ]
+    return sources
+
+# Get every figure of a script as a list of (name, plot, data, args), where
+# plot(data, *args) draws the figure. Views are taken from s, so each is built
+# once no matter how many figures use it
+def get_script_figures(s: session.Session, script: str):
+    figures = []
+    if script == "Ph_Plots":
+        figures.append(("Ph_Plots", Ph_Plots.plot_ph, Ph_Plots.get_ph_data(s.master()), ()))
+    if script == "fail_time":
+        data = fail_time.get_fail_time_data(s.master())
+        for voltage in data["Voltage"].unique():
+            figures.append((f"fail_time_{int(voltage)}V", fail_time.plot_fail_time, data[data["Voltage"] == voltage], (voltage,)))
+    if script == "current_time":
+        for voltage, voltage_data in current_time.iter_current_time_data(s.master()):
+            figures.append((f"current_time_{int(voltage)}V", current_time.plot_current_time, voltage_data, (voltage,)))
+    if script == "dendrites":
+        figures.append(("dendrites", dendrites.plot_channel_differences, dendrites.get_channel_differences(s.master_dendrite_score()), ()))
+    if script == "reliability":
+        curves = reliability.kaplan_meier(reliability.get_survival_data(s.master()))
+        for voltage in curves["Voltage"].unique():
+            figures.append((f"reliability_{int(voltage)}V", reliability.plot_survival, curves[curves["Voltage"] == voltage], (voltage,)))
+    return figures
+
+# Get every figure of the given scripts, (see get_script_figures)
+def get_figures(s: session.Session, scripts=SCRIPTS):
+    return [figure for script in scripts for figure in get_script_figures(s, script)]
+
+# Get a hash of a script's inputs, without building its data: the fingerprints
+# of the files its data is built from, (see reads.get_fingerprint), the code of
+# the script and the pipeline modules, and the file format and dpi its figures
+# are saved with. Editing a script, or any file its data comes from, draws its
+# figures again
+def get_input_hash(script: str, file_format: str, dpi):
+    input_hash = hashlib.sha1()
+    fingerprints = [(source, reads.get_fingerprint(source)) for source in get_script_sources(script)]
+    input_hash.update(repr((fingerprints, file_format, dpi)).encode())
+    for module in [SCRIPT_MODULES[script], *PIPELINE_MODULES]:
+        with open(inspect.getsourcefile(module), "rb") as file:
+            input_hash.update(file.read())
+    return input_hash.hexdigest()
+
+# Read the render manifest as a dict of figure name -> manifest entry
+def read_render_manifest(output_dir=FIGURE_DIR):
+    manifest_path = f"{output_dir}/{os.path.basename(RENDER_MANIFEST)}"
+    if not os.path.isfile(manifest_path):
+        return {}
+    manifest = pd.read_csv(manifest_path)
+    return {entry["Figure"]: entry for entry in manifest.to_dict("records")}
+
+# Write the render manifest, given a dict of figure name -> manifest entry
+def write_render_manifest(manifest: dict, output_dir=FIGURE_DIR):
+    columns = ["Script", "Figure", "Output", "Hash"]
+    pd.DataFrame(list(manifest.values()), columns=columns).to_csv(f"{output_dir}/{os.path.basename(RENDER_MANIFEST)}", index=False)
+
+# Draw a figure and save it to output_path, closing it afterwards so figures
+# don't pile up in memory. This is at the top level so that worker processes can
+# run it
+@instrument.stage("render.render_figure")
+def render_figure(plot, data: pd.DataFrame, args: tuple, output_path: str, dpi=None):
+    fig = plot(data, *args)
+    fig.savefig(output_path, dpi=dpi if dpi is not None else "figure")
+    plt.close(fig)
+    return output_path
+
+# Render the figures of the given scripts to output_dir, skipping scripts whose
+# inputs haven't changed since they were last rendered, (see get_input_hash),
+# unless force. A skipped script's data isn't built. Figures are drawn with
+# workers and chunk_size passed to parallel.run_tasks. file_format is any format
+# matplotlib can save, and dpi is the figures' own if None. Returns the paths of
+# the figures that were drawn
+def render_figures(scripts=SCRIPTS, output_dir=FIGURE_DIR, workers=1, chunk_size=1, force=False, file_format="png", dpi=None, s=None):
+    if s is None:
+        s = session.Session()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = read_render_manifest(output_dir)
+
+    tasks = []
+    entries = []
+    skipped = 0
+    for script in scripts:
+        input_hash = get_input_hash(script, file_format, dpi)
+        rendered_before = [entry for entry in manifest.values() if entry.get("Script") == script]
+        if not force and len(rendered_before) > 0 and all(
+            entry["Hash"] == input_hash and entry["Output"] == f"{output_dir}/{entry["Figure"]}.{file_format}" and os.path.isfile(entry["Output"])
+            for entry in rendered_before
+        ):
+            skipped += len(rendered_before)
+            continue
+
+        # Figures the script no longer makes, such as of a voltage that's gone,
+        # are forgotten
+        for entry in rendered_before:
+            del manifest[entry["Figure"]]
+        for name, plot, data, args in get_script_figures(s, script):
+            output_path = f"{output_dir}/{name}.{file_format}"
+            tasks.append((plot, data, args, output_path, dpi))
+            entries.append({"Script": script, "Figure": name, "Output": output_path, "Hash": input_hash})
+
+    rendered = []
+    for entry, output_path in zip(entries, parallel.run_tasks(render_figure, tasks, workers, chunk_size)):
+        manifest[entry["Figure"]] = entry
+        rendered.append(output_path)
+    write_render_manifest(manifest, output_dir)
+
+    print(f"Rendered {len(rendered)} figures to {output_dir}, skipped {skipped} that were up to date")
+    return rendered
+
+# Run Area ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the figures of the plotting scripts to files")
+    parser.add_argument("scripts", nargs="*", help=f"scripts to render, from {", ".join(SCRIPTS)}, every script by default")
+    parser.add_argument("--output-dir", default=FIGURE_DIR, help="where figures are written")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, 0 for one per CPU")
+    parser.add_argument("--force", action="store_true", help="render figures even if they're up to date")
+    parser.add_argument("--format", default="png", help="file format of the figures, such as png, pdf, or svg")
+    parser.add_argument("--dpi", type=float, default=None, help="resolution of the figures, their own by default")
+    args = parser.parse_args()
+    unknown = [script for script in args.scripts if script not in SCRIPTS]
+    if len(unknown) > 0:
+        parser.error(f"unknown scripts: {", ".join(unknown)}")
+
+    render_figures(args.scripts or SCRIPTS, args.output_dir, args.workers or None, force=args.force, file_format=args.format, dpi=args.dpi)
@@ -0,0 +1,81 @@
+# A session keeps the DataFrames built by adds.py in memory, so code that uses
+# several views, such as a notebook, only builds each one once. Each view is
+# built the first time it's asked for, and built again only when a file it
+# depends on changes.
+#
+# Sample use:
+#   s = session.Session()
+#   master = s.master()
+#   cf = s.master_cf_or_cv("CF") # Reuses master
+#
+# Views are shared rather than copied, so copy a view before changing it in
+# place, such as with master = s.master().copy()
+
+import adds
+import reads
+import typing
+
+# Directories of the sensor images joined onto master
+SENSOR_IMAGE_DIRS = adds.SENSOR_IMAGE_DIRS
+
+# Get the files and directories the master view is built from
+def get_master_sources():
+    return [reads.get_masterlist_path(), *SENSOR_IMAGE_DIRS, *reads.FILE_INDEX_DIRS]
+
+class Session:
+    def __init__(self):
+        # View name -> (fingerprint, view)
+        self.views = {}
+
+    # Get a view, building it if it hasn't been built, or if any of its source
+    # files or parent views changed since it was built. parents are the names of
+    # views it's built from, which must already be up to date
+    def get_view(self, name: str, sources: list, parents: list, build):
+        fingerprint = (
+            tuple(reads.get_fingerprint(source) for source in sources),
+            tuple(self.views[parent][0] for parent in parents)
+        )
+        if name not in self.views or self.views[name][0] != fingerprint:
+            self.views[name] = (fingerprint, build())
+        return self.views[name][1]
+
+    # Forget every view, so they're all built again
+    def clear(self):
+        self.views.clear()
+
+    # adds.get_master()
+    def master(self):
+        return self.get_view("master", get_master_sources(), [], adds.get_master)
+
+    # adds.get_master(dendrite_score_col=True), built from the master view
+    def master_dendrite_score(self, workers=1):
+        master = self.master()
+        return self.get_view(
+            "master_dendrite_score", SENSOR_IMAGE_DIRS, ["master"],
+            lambda: adds.add_dendrite_score(master, workers)
+        )
+
+    # adds.get_master_cf_or_cv(cf_or_cv), built from the master view
+    def master_cf_or_cv(self, cf_or_cv: typing.Literal["CF", "CV"]):
+        master = self.master()
+        sources = [f"{cf_or_cv}/{cf_or_cv}_PRISTINE", f"{cf_or_cv}/{cf_or_cv}_EXPOSED", f"{reads.STORE_DIR}/{cf_or_cv}.npy"]
+        return self.get_view(
+            f"master_{cf_or_cv}", sources, ["master"],
+            lambda: adds.get_master_cf_or_cv(cf_or_cv, master=master)
+        )
+
+    # adds.get_master_current_time(), built from the master view
+    def master_current_time(self):
+        master = self.master()
+        return self.get_view(
+            "master_current_time", ["CurrentTime", f"{reads.STORE_DIR}/CurrentTime.npy"], ["master"],
+            lambda: adds.get_master_current_time(master=master)
+        )
+
+    # adds.get_current_time_narrow(), built from the master view
+    def current_time_narrow(self):
+        master = self.master()
+        return self.get_view(
+            "current_time_narrow", ["CurrentTime", f"{reads.STORE_DIR}/CurrentTime.npy"], ["master"],
+            lambda: adds.get_current_time_narrow(master=master)
+        )